@@ -0,0 +1,171 @@
+import numpy as np
+import bitboard
+import numpy_policy
+
+# Deep Q-Learning in NumPy for the 'dql' players trained by Connect4.train_game, replacing the TensorFlow version
+# in ddqn.py. The agent has the same interface as ddqn.DQNAgent (memorize, act, replay, update_target_model, load,
+# save), but transitions are kept in a preallocated ring buffer and each replay is one batched forward and backward
+# pass over the whole minibatch. Actions and targets only consider legal columns, and saved models use the .npz
+# layout of numpy_policy, so they can be played as '.npz' players.
+
+
+# Replay memory of a fixed capacity, holding each field of the transitions in its own preallocated array.
+# New transitions overwrite the oldest ones once it is full.
+class ReplayBuffer:
+
+    def __init__(self, capacity, state_size):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_size), dtype=np.int8)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.int8)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.position = 0       # Index the next transition is written to
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # Stores a transition, overwriting the oldest one when full.
+    def add(self, state, action, reward, next_state, done):
+        i = self.position
+        self.states[i] = np.ravel(state)
+        self.next_states[i] = np.ravel(next_state)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # Returns (states, actions, rewards, next_states, dones) for batch_size transitions drawn uniformly with the generator.
+    def sample(self, batch_size, rng):
+        idx = rng.integers(self.size, size=batch_size)
+        return self.states[idx], self.actions[idx], self.rewards[idx], self.next_states[idx], self.dones[idx]
+
+
+# DQN (Double DQN by default) with a ReLU multi-layer perceptron trained with the Huber loss and Adam.
+class DQNAgent:
+
+    def __init__(self, state_size=42, action_size=7, hidden_sizes=(24, 24), memory_size=2000, gamma=0.95,
+                 learning_rate=0.001, epsilon=1.0, epsilon_min=0.01, epsilon_decay=0.99, double=True, seed=None):
+        self.state_size = state_size
+        self.action_size = action_size
+        self.memory = ReplayBuffer(memory_size, state_size)
+        self.gamma = gamma                      # Discount rate
+        self.epsilon = epsilon                  # Exploration rate, decayed after each replay
+        self.epsilon_min = epsilon_min
+        self.epsilon_decay = epsilon_decay
+        self.learning_rate = learning_rate
+        self.double = double                    # Online network picks the next action, target network values it
+        self.rng = np.random.default_rng(seed)
+
+        # Layers as (out, in) weights like numpy_policy, with Glorot uniform initialisation
+        sizes = (state_size, *hidden_sizes, action_size)
+        self.weights, self.biases = [], []
+        for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+            limit = np.sqrt(6 / (fan_in + fan_out))
+            self.weights.append(self.rng.uniform(-limit, limit, (fan_out, fan_in)).astype(np.float32))
+            self.biases.append(np.zeros(fan_out, dtype=np.float32))
+        self.update_target_model()
+
+        # Adam moment estimates for each parameter
+        self.params = self.weights + self.biases
+        self.first_moments = [np.zeros_like(param) for param in self.params]
+        self.second_moments = [np.zeros_like(param) for param in self.params]
+        self.updates = 0
+
+    # Copies the weights from the online network to the target network.
+    def update_target_model(self):
+        self.target_weights = [weight.copy() for weight in self.weights]
+        self.target_biases = [bias.copy() for bias in self.biases]
+
+    # Returns the input of every layer and the output of the last one for a batch of states.
+    def forward(self, states, weights, biases):
+        layers = [np.asarray(states, dtype=np.float32).reshape(-1, self.state_size)]
+        for i, (weight, bias) in enumerate(zip(weights, biases)):
+            x = layers[-1] @ weight.T + bias
+            layers.append(np.maximum(x, 0) if i < len(weights) - 1 else x)
+        return layers
+
+    # Returns the online network's Q-values for a batch of states.
+    def q_values(self, states):
+        return self.forward(states, self.weights, self.biases)[-1]
+
+    # Returns a random legal column with probability epsilon, otherwise the legal column with the best Q-value.
+    def act(self, state):
+        legal = bitboard.observation_action_mask(np.asarray(state))[0]
+        if self.rng.random() <= self.epsilon:
+            return int(self.rng.choice(np.flatnonzero(legal)))
+        return int(np.where(legal, self.q_values(state)[0], -np.inf).argmax())
+
+    def memorize(self, state, action, reward, next_state, done):
+        self.memory.add(state, action, reward, next_state, done)
+
+    # Takes one gradient step on a minibatch sampled from memory and returns its loss.
+    def replay(self, batch_size):
+        states, actions, rewards, next_states, dones = self.memory.sample(batch_size, self.rng)
+        rows = np.arange(batch_size)
+
+        # One online pass over the states and next states together, and one target pass over the next states
+        layers = self.forward(np.concatenate([states, next_states]), self.weights, self.biases)
+        q_values, online_next = layers[-1][:batch_size], layers[-1][batch_size:]
+        target_next = self.forward(next_states, self.target_weights, self.target_biases)[-1]
+
+        # Values of the next states over their legal columns only
+        legal = bitboard.observation_action_mask(next_states)
+        if self.double:
+            next_actions = np.where(legal, online_next, -np.inf).argmax(axis=1)
+            next_values = target_next[rows, next_actions]
+        else:
+            next_values = np.where(legal, target_next, -np.inf).max(axis=1)
+        targets = rewards + self.gamma * ~dones * next_values
+
+        # Huber loss on the Q-values of the actions taken, and its gradient with respect to every Q-value
+        errors = q_values[rows, actions] - targets
+        loss = float(np.where(np.abs(errors) <= 1, 0.5 * errors ** 2, np.abs(errors) - 0.5).mean())
+        grad = np.zeros((batch_size, self.action_size), dtype=np.float32)
+        grad[rows, actions] = np.clip(errors, -1, 1) / batch_size
+
+        # Backpropagating through the layers, over the states' rows only
+        weight_grads, bias_grads = [None] * len(self.weights), [None] * len(self.weights)
+        for i in reversed(range(len(self.weights))):
+            inputs = layers[i][:batch_size]
+            weight_grads[i] = grad.T @ inputs
+            bias_grads[i] = grad.sum(axis=0)
+            if i > 0:
+                grad = (grad @ self.weights[i]) * (inputs > 0)
+        self.adam_step(weight_grads + bias_grads)
+
+        if self.epsilon > self.epsilon_min:
+            self.epsilon *= self.epsilon_decay
+        return loss
+
+    # Updates every parameter in place with Adam given their gradients.
+    def adam_step(self, grads, beta1=0.9, beta2=0.999, eps=1e-7):
+        self.updates += 1
+        step = self.learning_rate * np.sqrt(1 - beta2 ** self.updates) / (1 - beta1 ** self.updates)
+        for param, grad, m, v in zip(self.params, grads, self.first_moments, self.second_moments):
+            m += (1 - beta1) * (grad - m)
+            v += (1 - beta2) * (grad * grad - v)
+            param -= step * m / (np.sqrt(v) + eps)
+
+    # Loads the online network's weights from a .npz file written by save (or export_model.py, for a matching network).
+    def load(self, name):
+        network = numpy_policy.NumpyQNetwork(name)
+        if any(activation not in ('ReLU', 'Identity') for activation in network.activation_names):
+            raise ValueError(f"Only ReLU networks can be loaded, not {network.activation_names}.")
+        for param, weight in zip(self.weights + self.biases, network.weights + network.biases):
+            param[...] = weight
+
+    # Returns the online network's arrays in numpy_policy's layout (as export_model.network_arrays does for a model).
+    def arrays(self):
+        activations = ['ReLU'] * (len(self.weights) - 1) + ['Identity']
+        arrays = {'num_layers': len(self.weights), 'activations': np.array(activations),
+                  'exploration_rate': self.epsilon}
+        arrays.update({f'weight_{i}': weight for i, weight in enumerate(self.weights)})
+        arrays.update({f'bias_{i}': bias for i, bias in enumerate(self.biases)})
+        return arrays
+
+    # Writes the online network to a .npz path or file object, in numpy_policy's layout.
+    def save(self, name):
+        np.savez(name, **self.arrays())
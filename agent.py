@@ -1,17 +1,38 @@
+import math
 import random
+import time
+from collections import OrderedDict
 import numpy as np
-#from DQN.ddqn import DQNAgent
-from stable_baselines3 import PPO, DQN
+import bitboard
+import model_registry
+import numpy_policy
+import solver
+from DQN.numpy_dqn import DQNAgent
+
+# torch and Stable Baselines3 take seconds to import, so they are only imported by the agents that run a model,
+# when the model is first used (see model_registry.py)
 
 # Template class to act as a parent to the different possible agents
 class Player():
     def __init__(self, symbol, headless):
         self.symbol = symbol
         self.headless = headless
+        self.book = None    # Opening book consulted before searching or running a model
 
     def next_move(self, moves, curr_state):
         pass
 
+    # Returns the opening book's move for the state if there is one, or None.
+    def book_move(self, moves, curr_state):
+        if self.book is None:
+            return None
+        action = self.book.lookup_state(curr_state)
+        if action not in moves:
+            return None
+        if not self.headless:
+            print(f"Agent '{self.symbol}' plays book move {action + 1}")
+        return action
+
 
 class HumanPlayer(Player):
     def next_move(self, moves, curr_state):
@@ -39,6 +60,37 @@ class RandomAgent(Player):
         return action
 
 
+# Plays by negamax search with alpha-beta pruning over the bitboard.
+# Spec strings select the search budget: "solver" (default depth), "solver:10" (depth 10) or "solver:0.5s" (0.5 seconds per move).
+class SolverAgent(Player):
+    def __init__(self, symbol, headless, max_depth=8, time_limit=None, table_mb=16):
+        super().__init__(symbol, headless)
+        self.solver = solver.Solver(max_depth=max_depth, time_limit=time_limit, table_mb=table_mb)
+
+    @classmethod
+    def from_spec(cls, symbol, headless, spec):
+        budget = spec.partition(':')[2]
+        if budget.endswith('s'):
+            # Time budget, searched as deep as it allows
+            return cls(symbol, headless, max_depth=42, time_limit=float(budget[:-1]))
+        if budget:
+            return cls(symbol, headless, max_depth=int(budget))
+        return cls(symbol, headless)
+
+    def next_move(self, moves, curr_state):
+        action = self.book_move(moves, curr_state)
+        if action is not None:
+            return action
+
+        action, score = self.solver.search(solver.Position.from_state(curr_state))
+        if not self.headless:
+            # The solver has no transposition table when it was given no memory for one
+            table_str = 'no table' if self.solver.table is None else f"table hit rate {self.solver.table.stats()['hit_rate']:.2f}"
+            print(f"Solver Agent '{self.symbol}' chooses column {action + 1} (score {score}, depth {self.solver.depth_reached}, "
+                  f"{self.solver.nodes} nodes, {self.solver.nodes_per_second():.0f} nodes/s, {table_str})")
+        return action
+
+
 # class HeuristicAgent(Player):
 #     def next_move(self, moves, curr_state):
 #     def next_move(self, moves, curr_state):
@@ -50,7 +102,8 @@ class RLAgent(Player):
     def learn(self, state, action1, reward1, next_state1):
         pass
 
-"""class DeepQLearningAgent(RLAgent):
+# Trained by Connect4.train_game with the NumPy DQN in DQN/numpy_dqn.py
+class DeepQLearningAgent(RLAgent):
     def __init__(self, symbol, headless, mode, game, model_file=None):
         super().__init__(symbol, headless)
 
@@ -60,32 +113,354 @@ class RLAgent(Player):
 
     # Define function to choose an action using epsilon-greedy policy
     def next_move(self, moves, curr_state):
-        state = np.reshape(curr_state, [1, 42])
-        return self.agent.act(state)
+        return self.agent.act(curr_state)
         
     # Define function to update Q-values
     def learn(self, episode, prev_state, action, reward, next_state, done, info=[{}]):
-        self.agent.memorize(np.reshape(prev_state, [1, 42]), action, reward, np.reshape(next_state, [1, 42]), done)
-"""
+        self.agent.memorize(prev_state, action, reward, next_state, done)
+
+
+# Bounded least-recently-used cache of model actions keyed by position, with hit/miss/eviction counters.
+class InferenceCache:
+
+    def __init__(self, max_size=100_000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Clears the hit/miss/eviction counters.
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # Entries dropped to stay within max_size
+
+    # Returns the counters as a dictionary.
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    # Empties the cache.
+    def clear(self):
+        self.entries.clear()
+
+    # Returns the value stored for the key (marking it as recently used), or None.
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # Stores the value, evicting the least recently used entry if the cache is full.
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+# Inference caches by model file (as registered in the model registry, so a rewritten file gets a new cache),
+# so every game in a process playing the same model shares one. A cache is dropped along with its model.
+inference_caches = {}
+
+
+# Returns the shared inference cache for the model file, creating it on first use.
+def get_inference_cache(model, max_size):
+    key = model_registry.registry.key(model)
+    if key not in inference_caches:
+        inference_caches[key] = InferenceCache(max_size)
+    return inference_caches[key]
+
+
+# Drops the inference cache of a model dropped by the registry.
+def drop_inference_cache(key):
+    inference_caches.pop(key, None)
+
+
+model_registry.registry.on_drop.append(drop_inference_cache)
 
 
 class DeepQLearningAgentSB(RLAgent):
-    def __init__(self, symbol, headless, mode, model=None):
+    def __init__(self, symbol, headless, mode, model=None, deterministic=False, cache_size=0, symmetric=False):
         super().__init__(symbol, headless)
         self.mode = mode
-        if model is not None:
-            self.agent = DQN.load(model)
-        else:
+        self.deterministic = deterministic      # Always play the greedy action instead of the model's exploration rate
+        self.symmetric = symmetric              # The model plays mirrored positions with mirrored actions
+        self.model_path = model
+        self.dispatcher = None                  # Batches model calls with other games when set (see inference.py)
+        self.loaded_model = None                # Shared model from the registry, fetched on first use
+        if model is None:
             print("No previous model found, using random actions")
-            self.agent = None
+
+        # Only deterministic actions can be reused, so the cache is only kept for deterministic play
+        self.cache = get_inference_cache(model, cache_size) if deterministic and cache_size and model else None
 
     def next_move(self, moves, curr_state):
         if self.mode == 'train' and not hasattr(self, 'agent'):
             return random.choice(moves)
-        action, _ = self.agent.predict(curr_state)
-        if action not in moves:
-            action = random.choice(moves)
+        action = self.book_move(moves, curr_state)
+        if action is not None:
+            return action
+
+        # Running the model unless the position's action is cached. Positions are cached under their Zobrist hash, so
+        # the cache never changes how the model plays. Only for a model known to be symmetric do a position and its
+        # mirror image share an entry (under the canonical key), the action being mirrored back for the other one.
+        if self.cache is not None:
+            position = solver.Position.from_state(curr_state)
+            key, mirrored = position.canonical() if self.symmetric else (position.hash, False)
+            action = self.cache.get(key)
+            if action is None:
+                action = self.predict(curr_state, True)
+                self.cache.put(key, bitboard.WIDTH - 1 - action if mirrored else action)
+            elif mirrored:
+                action = bitboard.WIDTH - 1 - action
+        else:
+            action = self.predict(curr_state, self.deterministic)
         return action
 
+    # The model played by the agent, loaded through the process-wide registry the first time it is needed
+    # and shared with every other game playing the same file.
+    @property
+    def agent(self):
+        if self.loaded_model is None and self.model_path is not None:
+            self.loaded_model = model_registry.load_model(self.model_path)
+        return self.loaded_model
+
+    # Returns the model's action for the state, through the batching dispatcher if the agent has one: a random legal
+    # column at the model's exploration rate (unless deterministic), otherwise the legal column with the best Q-value.
+    def predict(self, curr_state, deterministic):
+        if self.dispatcher is not None:
+            return self.dispatcher.predict(curr_state, deterministic)
+
+        import masked_dqn
+        if not deterministic and np.random.rand() < self.agent.exploration_rate:
+            return int(masked_dqn.random_legal_actions(curr_state)[0])
+        return int(masked_dqn.greedy_actions(self.agent.policy, curr_state)[0])
+
     def learn(self):
         pass  # Training handled in main.py
+
+
+# Plays a DQN model exported to .npz (see export_model.py), running the Q-network in NumPy instead of torch.
+# The model is the .npz path or an already built NumpyQNetwork.
+class NumpyQAgent(Player):
+    def __init__(self, symbol, headless, model, deterministic=False):
+        super().__init__(symbol, headless)
+        self.network = model if isinstance(model, numpy_policy.NumpyQNetwork) else numpy_policy.load_network(model)
+        self.deterministic = deterministic      # Always play the greedy action instead of the model's exploration rate
+
+    def next_move(self, moves, curr_state):
+        action = self.book_move(moves, curr_state)
+        if action is not None:
+            return action
+
+        # Exploring at the model's exploration rate like DQN.predict, otherwise taking the best legal column
+        if not self.deterministic and np.random.rand() < self.network.exploration_rate:
+            return random.choice(moves)
+        return int(self.network.predict(curr_state)[0])
+
+
+# Node of the MCTS tree. Values are from the point of view of the player who made the move into the node.
+class MCTSNode:
+    __slots__ = ('prior', 'visits', 'value_sum', 'children', 'expanded')
+
+    def __init__(self, prior):
+        self.prior = prior
+        self.visits = 0
+        self.value_sum = 0.0
+        self.children = {}      # Column -> MCTSNode
+        self.expanded = False
+
+    def value(self):
+        return self.value_sum / self.visits if self.visits else 0.0
+
+
+# Monte Carlo Tree Search guided by a trained SB3 DQN. The Q-values of a position give the priors of its moves
+# (softmax over the legal columns) and its value (best legal Q-value over value_scale, the win reward). Leaves are gathered
+# in batches, with a virtual loss steering each selection away from the others, so one q_net forward pass
+# evaluates the whole batch. The subtree of the move actually played is kept for the next move.
+# Spec strings: "mcts:MODEL" (default budget), "mcts:MODEL:800" (800 simulations) or "mcts:MODEL:0.5s" (0.5 seconds).
+class MCTSAgent(Player):
+    def __init__(self, symbol, headless, mode, model, simulations=400, time_limit=None, batch_size=16,
+                 c_puct=1.5, temperature=10.0, virtual_loss=1.0, value_scale=100.0):
+        super().__init__(symbol, headless)
+        self.network = DeepQLearningAgentSB(symbol, True, mode, model=model)
+        self.policy = self.network.agent.policy
+        self.policy.set_training_mode(False)
+
+        self.simulations = simulations      # Simulations per move (ignored when there is a time limit)
+        self.time_limit = time_limit        # Seconds per move
+        self.batch_size = batch_size        # Leaves evaluated per forward pass
+        self.c_puct = c_puct                # Weight of the prior in the selection rule
+        self.temperature = temperature      # Softmax temperature turning Q-values into priors
+        self.virtual_loss = virtual_loss
+        self.value_scale = value_scale      # Q-value of a certain win (deepq.WIN_RW during training)
+
+        # Tree kept between moves, with the position at its root
+        self.root = None
+        self.root_position = None
+
+        # Statistics of the last search
+        self.last_simulations = 0
+        self.last_batches = 0
+        self.last_elapsed = 0.0
+
+    @classmethod
+    def from_spec(cls, symbol, headless, mode, spec):
+        model = spec.partition(':')[2]
+        path, _, budget = model.rpartition(':')
+        if path and budget.endswith('s') and budget[:-1].replace('.', '', 1).isdigit():
+            return cls(symbol, headless, mode, path, time_limit=float(budget[:-1]))
+        if path and budget.isdigit():
+            return cls(symbol, headless, mode, path, simulations=int(budget))
+        return cls(symbol, headless, mode, model)
+
+    def next_move(self, moves, curr_state):
+        action = self.book_move(moves, curr_state)
+        if action is not None:
+            return action
+
+        position = solver.Position.from_state(curr_state)
+        self.reuse_tree(position)
+        self.search(position)
+
+        # Playing the most visited move and keeping its subtree
+        action = max(self.root.children, key=lambda col: self.root.children[col].visits)
+        self.root = self.root.children[action]
+        position.play(action)
+        self.root_position = (position.current, position.mask)
+
+        if not self.headless:
+            rate = self.last_simulations / self.last_elapsed if self.last_elapsed > 0 else 0.0
+            print(f"MCTS Agent '{self.symbol}' chooses column {action + 1} ({self.last_simulations} simulations "
+                  f"in {self.last_batches} batches, {rate:.0f} simulations/s)")
+        return action
+
+    # Moves the root to the node for the position if it is the kept root or one of its children, or starts a new tree.
+    def reuse_tree(self, position):
+        key = (position.current, position.mask)
+        if self.root is not None and self.root_position is not None:
+            if key == self.root_position:
+                return
+            previous = solver.Position(*self.root_position)
+            for col, child in self.root.children.items():
+                previous.play(col)
+                if (previous.current, previous.mask) == key:
+                    self.root = child
+                    self.root_position = key
+                    return
+                previous.undo(col)
+        self.root = MCTSNode(1.0)
+        self.root_position = key
+
+    # Runs simulations from the root until the budget is used up.
+    def search(self, position):
+        start = time.perf_counter()
+        deadline = start + self.time_limit if self.time_limit is not None else None
+        simulations = 0
+        batches = 0
+
+        if not self.root.expanded:
+            self.evaluate([(self.root, [self.root], self.observation(position), position.possible())])
+
+        while True:
+            if deadline is not None:
+                if time.perf_counter() > deadline:
+                    break
+            elif simulations >= self.simulations:
+                break
+
+            # Selecting a batch of leaves, each with virtual loss applied along its path
+            pending = []
+            for _ in range(self.batch_size):
+                leaf = self.select(position)
+                if leaf is not None:
+                    pending.append(leaf)
+                simulations += 1
+            if pending:
+                self.evaluate(pending)
+            batches += 1
+
+        self.last_simulations = simulations
+        self.last_batches = batches
+        self.last_elapsed = time.perf_counter() - start
+
+    # Walks down the tree from the root and returns (leaf, path, observation, playable cells) for a leaf that
+    # needs the network, or None when the walk ended in a finished game (which is backed up straight away).
+    def select(self, position):
+        node = self.root
+        path = [node]
+        played = []
+        value = None
+        while node.expanded:
+            sqrt_visits = math.sqrt(node.visits + 1)
+            col, node = max(node.children.items(),
+                            key=lambda item: item[1].value() + self.c_puct * item[1].prior * sqrt_visits / (1 + item[1].visits))
+            node.visits += self.virtual_loss
+            node.value_sum -= self.virtual_loss
+            path.append(node)
+
+            # Finished games get their exact value for the player who moved into the node
+            if position.is_winning_move(col):
+                value = 1.0
+            elif position.moves == 41:
+                value = 0.0
+            position.play(col)
+            played.append(col)
+            if value is not None:
+                break
+
+        leaf = None
+        if value is None:
+            leaf = (node, path, self.observation(position), position.possible())
+        else:
+            self.backup(path, value)
+        for col in reversed(played):
+            position.undo(col)
+        return leaf
+
+    # Evaluates a batch of leaves with one forward pass, expands them and backs their values up.
+    def evaluate(self, pending):
+        import torch as th
+
+        observations = np.stack([observation for _, _, observation, _ in pending])
+        with th.no_grad():
+            obs_tensor, _ = self.policy.obs_to_tensor(observations)
+            q_values = self.policy.q_net(obs_tensor).cpu().numpy()
+
+        for (node, path, _, possible), q in zip(pending, q_values):
+            legal = [col for col in range(7) if possible & bitboard.COLUMN_MASKS[col]]
+            legal_q = q[legal]
+
+            if not node.expanded:
+                priors = np.exp((legal_q - legal_q.max()) / self.temperature)
+                priors /= priors.sum()
+                for col, prior in zip(legal, priors):
+                    node.children[col] = MCTSNode(float(prior))
+                node.expanded = True
+
+            # Value for the player to move at the leaf, negated for the player who moved into it
+            value = float(np.clip(legal_q.max() / self.value_scale, -1.0, 1.0))
+            self.backup(path, -value)
+
+    # Removes the virtual loss along the path and adds the value, flipping its sign at each level.
+    def backup(self, path, value):
+        for node in reversed(path):
+            if node is not self.root:
+                node.visits -= self.virtual_loss
+                node.value_sum += self.virtual_loss
+            node.visits += 1
+            node.value_sum += value
+            value = -value
+
+    # Returns the observation of the position for the player to move.
+    def observation(self, position):
+        opponent = position.current ^ position.mask
+        return bitboard.to_array(position.current) - bitboard.to_array(opponent)
@@ -0,0 +1,116 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Performance checks that fail (exit status 1) when a budget is exceeded.
+#   python benchmark.py startup
+#   python benchmark.py replay
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold start budgets in seconds for a fresh interpreter importing each module (interpreter start included).
+# run.py is the web server, whose start-up time is paid on every Cloud Run cold start.
+STARTUP_BUDGETS = {'game': 1.0, 'run': 2.0}
+
+# Modules that must not be imported until a model is actually used
+HEAVY_MODULES = ('torch', 'stable_baselines3', 'tensorflow')
+
+
+# Returns the best of several wall times for a fresh interpreter importing the module, and the heavy
+# modules the import pulled in.
+def time_startup(module, repeats=5):
+    code = f"import sys, {module}; print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    best, heavy = float('inf'), []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], cwd=REPO_DIR, capture_output=True,
+                                text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+        best = min(best, elapsed)
+        heavy = [name for name in result.stdout.strip().split(',') if name]
+    return best, heavy
+
+
+# Times the cold start of each module against its budget and returns True if all of them are within it.
+def benchmark_startup(budgets=STARTUP_BUDGETS):
+    passed = True
+    for module, budget in budgets.items():
+        elapsed, heavy = time_startup(module)
+        ok = elapsed <= budget and not heavy
+        passed = passed and ok
+        heavy_str = f"\tImported: {', '.join(heavy)}" if heavy else ''
+        print(f"{'PASS' if ok else 'FAIL'}\timport {module}: {elapsed:.3f}s (budget {budget:.1f}s){heavy_str}")
+    return passed
+
+
+# Prioritized replay buffer size and minibatch the sum-tree is timed at
+REPLAY_ENTRIES = 1_000_000
+REPLAY_BATCH = 256
+
+# Budgets in milliseconds per minibatch, far below what an O(n) pass over 1M priorities takes
+REPLAY_BUDGETS = {'tree sample': 0.5, 'tree update': 0.5, 'buffer sample': 1.0, 'buffer update': 0.5, 'add': 0.05}
+
+
+# Returns the mean seconds per call of the function, after one warm-up call.
+def time_calls(function, calls):
+    function()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+# Times sampling and priority updates of the sum-tree and the full prioritized replay buffer (including building the
+# minibatch) with every entry filled, and returns True if all of them are within budget.
+def benchmark_replay(entries=REPLAY_ENTRIES, batch_size=REPLAY_BATCH, budgets=REPLAY_BUDGETS, calls=2000):
+    import numpy as np
+    from gymnasium import spaces
+    from replay import PrioritizedReplayBuffer
+
+    rng = np.random.default_rng(0)
+    buffer = PrioritizedReplayBuffer(entries, spaces.Box(low=-1, high=1, shape=(6, 7), dtype=np.int8),
+                                     spaces.Discrete(7), device='cpu')
+    buffer.full = True
+    buffer.tree.update(np.arange(entries), rng.random(entries))
+    tree = buffer.tree
+    obs = np.zeros((1, 6, 7), dtype=np.int8)
+
+    times = {
+        'tree sample': time_calls(lambda: tree.find(rng.random(batch_size) * tree.total()), calls),
+        'tree update': time_calls(lambda: tree.update(rng.integers(entries, size=batch_size), rng.random(batch_size)), calls),
+        'buffer sample': time_calls(lambda: buffer.sample(batch_size), calls),
+        'buffer update': time_calls(lambda: buffer.update_priorities(rng.integers(entries, size=batch_size),
+                                                                     rng.normal(size=batch_size)), calls),
+        'add': time_calls(lambda: buffer.add(obs, obs, np.zeros(1), np.zeros(1), np.zeros(1), [{}]), calls),
+    }
+
+    passed = True
+    for name, elapsed in times.items():
+        ok = elapsed * 1000 <= budgets[name]
+        passed = passed and ok
+        per_call = 1 if name == 'add' else batch_size
+        print(f"{'PASS' if ok else 'FAIL'}	replay {name} ({entries:,} entries, {per_call} per call): "
+              f"{elapsed * 1e6:.1f}us, {per_call / elapsed:,.0f} transitions/s (budget {budgets[name] * 1000:.0f}us)")
+    return passed
+
+
+BENCHMARKS = {'startup': benchmark_startup, 'replay': benchmark_replay}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Connect4 performance benchmarks')
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f"Benchmarks to run, from {', '.join(BENCHMARKS)} (default: all of them).")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    results = [BENCHMARKS[name]() for name in args.benchmarks or BENCHMARKS]
+    if not all(results):
+        sys.exit(1)
@@ -0,0 +1,124 @@
+import random
+import numpy as np
+
+# Board dimensions
+WIDTH = 7
+HEIGHT = 6
+H1 = HEIGHT + 1     # Each column gets one spare bit on top so shifted lines never wrap into the next column
+
+# Bit layout: the cell (col, row) is stored at bit col * H1 + row, with row 0 at the bottom
+BOTTOM_MASK = sum(1 << (col * H1) for col in range(WIDTH))
+BOARD_MASK = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+COLUMN_MASKS = [((1 << HEIGHT) - 1) << (col * H1) for col in range(WIDTH)]
+
+
+# Returns the single bit used for the given cell.
+def cell_bit(col, row):
+    return 1 << (col * H1 + row)
+
+
+# Returns the mask with its columns in reverse order, i.e. the board's left-right mirror image.
+def mirror(mask):
+    mirrored = 0
+    for col in range(WIDTH):
+        mirrored |= ((mask >> (col * H1)) & COLUMN_MASKS[0]) << ((WIDTH - 1 - col) * H1)
+    return mirrored
+
+
+# Bit index of each cell's mirror image
+MIRROR_INDEX = [(WIDTH - 1 - index // H1) * H1 + index % H1 for index in range(WIDTH * H1)]
+
+
+# Converts a mask to a 6x7 int8 array of 0/1 in observation layout (top row first).
+def to_array(mask):
+    bits = np.unpackbits(np.frombuffer(mask.to_bytes(8, 'little'), dtype=np.uint8), bitorder='little')
+    return bits[:WIDTH * H1].reshape(WIDTH, H1)[:, HEIGHT - 1::-1].T.astype(np.int8)
+
+
+# Legal-move lookups indexed by a 7-bit mask of playable columns (bit c set when column c is not full).
+# The lists and arrays are shared between callers, so they must not be modified.
+FULL_LEGAL_MASK = (1 << WIDTH) - 1
+VALID_ACTIONS = [[col for col in range(WIDTH) if mask >> col & 1] for mask in range(FULL_LEGAL_MASK + 1)]
+ACTION_MASKS = np.array([[bool(mask >> col & 1) for col in range(WIDTH)] for mask in range(FULL_LEGAL_MASK + 1)])
+ACTION_MASKS.flags.writeable = False
+
+
+# Returns the (N, 7) legal-move mask of a batch of observations (NumPy arrays or torch tensors of shape (N, 6, 7)
+# or (N, 42)): a column is legal while its top cell is empty. Full boards get every column marked legal, so a
+# maximum taken over the legal columns is always defined.
+def observation_action_mask(obs):
+    mask = obs.reshape(-1, HEIGHT, WIDTH)[:, 0, :] == 0
+    return mask | (mask.sum(1) == 0).reshape(-1, 1)
+
+
+# All 69 four-cell windows a line can be made in, as (direction, ((col, row), ...)) pairs
+WINDOW_STEPS = {'v': (0, 1), 'h': (1, 0), 'du': (1, 1), 'dd': (1, -1)}
+WINDOWS = [
+    (direction, tuple((col + dc * i, row + dr * i) for i in range(4)))
+    for direction, (dc, dr) in WINDOW_STEPS.items()
+    for col in range(WIDTH)
+    for row in range(HEIGHT)
+    if 0 <= col + dc * 3 < WIDTH and 0 <= row + dr * 3 < HEIGHT
+]
+WINDOW_DIRECTIONS = [direction for direction, _ in WINDOWS]
+
+# Window cells as flat indices into a 6x7 observation (index (5 - row) * 7 + col), shape (69, 4)
+WINDOW_INDICES = np.array([[(HEIGHT - 1 - row) * WIDTH + col for col, row in cells] for _, cells in WINDOWS])
+WINDOW_INDICES.flags.writeable = False
+
+# Bit mask of each window, and for each bit index the windows passing through that cell (at most 16)
+WINDOW_MASKS = [sum(cell_bit(col, row) for col, row in cells) for _, cells in WINDOWS]
+CELL_WINDOWS = [[w for w, window in enumerate(WINDOW_MASKS) if window >> bit & 1] for bit in range(WIDTH * H1)]
+
+# The same table for flat observation indices, as a (42, 69) boolean array
+CELL_WINDOW_TABLE = np.zeros((WIDTH * HEIGHT, len(WINDOWS)), dtype=bool)
+CELL_WINDOW_TABLE[WINDOW_INDICES, np.arange(len(WINDOWS))[:, None]] = True
+CELL_WINDOW_TABLE.flags.writeable = False
+
+# Bit values of the cells of a 6x7 observation, used to turn arrays back into masks
+OBS_BITS = np.array([[1 << (col * H1 + row) for col in range(WIDTH)] for row in range(HEIGHT - 1, -1, -1)], dtype=np.uint64)
+
+
+# Converts a 6x7 array in observation layout to the mask of its nonzero cells.
+def from_array(arr):
+    return int(np.bitwise_or.reduce(OBS_BITS[np.asarray(arr) != 0]))
+
+
+# Returns the number of set bits in a mask.
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+# Returns the empty cells that would complete a four-in-a-row for the given player's mask.
+def winning_cells(position, mask):
+    # Vertical
+    cells = (position << 1) & (position << 2) & (position << 3)
+
+    # Horizontal and both diagonals, covering each of the four places the empty cell can take in the line
+    for shift in (H1, H1 - 1, H1 + 1):
+        pairs = (position << shift) & (position << 2 * shift)
+        cells |= pairs & (position << 3 * shift)
+        cells |= pairs & (position >> shift)
+        pairs = (position >> shift) & (position >> 2 * shift)
+        cells |= pairs & (position << shift)
+        cells |= pairs & (position >> 3 * shift)
+
+    return cells & (BOARD_MASK ^ mask)
+
+
+# Zobrist keys for each piece colour (0 for the player who moved first) and bit position. They come from a
+# fixed seed so hashes are the same in every process and run.
+zobrist_rng = random.Random(5214)
+ZOBRIST_KEYS = [[zobrist_rng.getrandbits(64) for _ in range(WIDTH * H1)] for _ in range(2)]
+
+
+# Computes the Zobrist hash of a position from scratch, given the first and second player's masks.
+# The hash of the mirror image is zobrist_hash(mirror(first), mirror(second)).
+def zobrist_hash(first, second):
+    key = 0
+    for color, mask in enumerate((first, second)):
+        while mask:
+            bit = mask & -mask
+            key ^= ZOBRIST_KEYS[color][bit.bit_length() - 1]
+            mask ^= bit
+    return key
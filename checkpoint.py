@@ -0,0 +1,126 @@
+import io
+import os
+import queue
+import threading
+import time
+
+# Checkpoints written without stalling training.
+# A checkpoint is serialized into memory straight away (so later training can't change it), then written by a
+# background thread to a temporary file that is renamed over its final name once complete, so a checkpoint file is
+# never seen half-written. After each write the retention policy deletes the run's older checkpoints, keeping the
+# last keep_last of them plus the best scoring one. Files that weren't written by the manager are never deleted, and
+# checkpoints already deleted by someone else are simply forgotten.
+
+
+class CheckpointManager:
+
+    def __init__(self, directory='models', keep_last=5):
+        self.directory = directory
+        self.keep_last = keep_last      # Most recent checkpoints kept, besides the best one (0 keeps every checkpoint)
+        self.checkpoints = []           # (path, score) of the checkpoints written and kept, oldest first
+        self.best = None                # (path, score) of the best scoring checkpoint kept
+        self.error = None               # Exception raised by the writer thread, raised again in the training thread
+        self.reset_stats()
+
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    # Clears the write/delete counters.
+    def reset_stats(self):
+        self.saves = 0              # Checkpoints handed to the manager
+        self.writes = 0             # Checkpoints written to disk
+        self.deletes = 0            # Checkpoints deleted by the retention policy
+        self.bytes_written = 0
+        self.serialize_time = 0.0   # Seconds the training thread spent serializing checkpoints
+        self.write_time = 0.0       # Seconds the writer thread spent writing checkpoints
+
+    # Returns the counters as a dictionary.
+    def stats(self):
+        return {'saves': self.saves, 'writes': self.writes, 'deletes': self.deletes, 'pending': self.queue.qsize(),
+                'bytes_written': self.bytes_written, 'serialize_time': self.serialize_time,
+                'write_time': self.write_time}
+
+    # Serializes a checkpoint with write (a function writing it to a file object, e.g. a Stable Baselines model's save)
+    # and queues it to be written as name in the directory. The score (higher is better, or None) picks the best
+    # checkpoint kept by the retention policy. Returns the path the checkpoint will be written to.
+    def save(self, write, name, score=None):
+        self.raise_error()
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        write(buffer)
+        self.serialize_time += time.perf_counter() - start
+        self.saves += 1
+
+        path = os.path.join(self.directory, name)
+        self.queue.put((path, buffer.getvalue(), score))
+        return path
+
+    # Blocks until every queued checkpoint has been written.
+    def wait(self):
+        self.queue.join()
+        self.raise_error()
+
+    # Writes the queued checkpoints and stops the writer thread.
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+    # Raises the writer thread's exception, if it had one.
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # Writer thread: writes each queued checkpoint and applies the retention policy, until close() is called.
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    # Writes the data to the path through a temporary file, then drops the checkpoints no longer kept.
+    def write(self, path, data, score):
+        start = time.perf_counter()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        self.write_time += time.perf_counter() - start
+        self.writes += 1
+        self.bytes_written += len(data)
+
+        # Rewriting a name replaces its earlier checkpoint (and its score), and checkpoints deleted by someone else are
+        # forgotten, so the best is picked again from the checkpoints kept (the earliest of equal scores)
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints
+                            if checkpoint[0] != path and os.path.exists(checkpoint[0])]
+        self.checkpoints.append((path, score))
+        scored = [checkpoint for checkpoint in self.checkpoints if checkpoint[1] is not None]
+        self.best = max(scored, key=lambda checkpoint: checkpoint[1]) if scored else None
+        self.apply_retention()
+
+    # Deletes the checkpoints that are neither among the last keep_last nor the best one.
+    def apply_retention(self):
+        if not self.keep_last:
+            return
+        kept = []
+        for i, (path, score) in enumerate(self.checkpoints):
+            if i >= len(self.checkpoints) - self.keep_last or (self.best is not None and path == self.best[0]):
+                kept.append((path, score))
+            else:
+                try:
+                    os.remove(path)
+                    self.deletes += 1
+                except FileNotFoundError:
+                    pass
+        self.checkpoints = kept
@@ -1,7 +1,20 @@
+import numpy as np
+import bitboard
 import game
 
 WIN_RW = 100.0
 LOSS_RW = -100.0
+LIVING_RW = -0.5
+BLOCK_RW = 3.0
+INVALID_RW = -10.0
+
+# Richer shaping terms, only used when training with rich shaping (main.py --rich_shaping), so rewards otherwise
+# stay the same as the ones existing models were trained on
+THREE_RW = 3.0      # Move makes an open three (three own pieces and an empty cell in one window)
+TWO_RW = 0.5        # Move makes an open two, when it makes no open three
+FORK_RW = 3.0       # Move makes open threes completed by two or more different cells
+THREAT_RW = -3.0    # Opponent can win with their next move
+CENTER_RW = np.array([0.0, 0.0, 0.1, 0.2, 0.1, 0.0, 0.0])
 
 def creates_sequence(self, col, row, symbol, length, spaces_allowed=0) -> tuple[bool, str]:
     """Check if the move creates a sequence of given length"""
@@ -43,103 +56,95 @@ def creates_sequence(self, col, row, symbol, length, spaces_allowed=0) -> tuple[
 
 def opponent_can_create_sequence(self, opponent_symbol, length, spaces_allowed=0):
     """Check if opponent can create a sequence of given length in their next move"""
+    # Winning moves are read straight from the board's window counts
+    if length == 4 and spaces_allowed == 0:
+        return bool(self.board.winning_columns(opponent_symbol))
+
     for col in self.get_valid_actions():
-        row = self.board.available_slot_in_col(col)
-        if row is not None:
-            # Temporarily place opponent's piece
-            self.board.game_board[col][row].update_status(opponent_symbol)
-            
-            # Check if this creates a sequence
-            has_sequence, dir = creates_sequence(self, col, row, opponent_symbol, length, spaces_allowed)
-            
-            # Remove the temporary piece
-            self.board.game_board[col][row].update_status(' ')
-            
-            if has_sequence:
-                return True
+        # Temporarily place opponent's piece
+        row = self.board.push(col, opponent_symbol)
+
+        # Check if this creates a sequence
+        has_sequence, dir = creates_sequence(self, col, row, opponent_symbol, length, spaces_allowed)
+
+        # Remove the temporary piece
+        self.board.pop()
+
+        if has_sequence:
+            return True
     return False
 
+def move_features(board, col, row, symbol):
+    """Shaping features of the move just played at (col, row), from the mover's side"""
+    i = board.symbol_index[symbol]
+    own_counts, opponent_counts = board.window_counts[i], board.window_counts[1 - i]
+    empty = bitboard.BOARD_MASK ^ (board.bitboards[0] | board.bitboards[1])
+
+    # One pass over the board's counts for the windows through the placed piece
+    win = block = False
+    threes = twos = 0
+    three_cells = 0
+    for w in bitboard.CELL_WINDOWS[col * bitboard.H1 + row]:
+        own_count = own_counts[w]
+        opponent_count = opponent_counts[w]
+        if own_count == 4:
+            win = True
+        elif opponent_count == 3:
+            block = True    # The opponent would have won by playing this cell
+        elif opponent_count == 0:
+            if own_count == 3:
+                threes += 1
+                three_cells |= bitboard.WINDOW_MASKS[w] & empty
+            elif own_count == 2:
+                twos += 1
+
+    # Whether the opponent is left with a playable winning cell
+    threat = bool(board.winning_columns(board.symbols[1 - i]))
+
+    return {'win': win, 'block': block, 'threes': threes, 'twos': twos,
+            'fork': bitboard.popcount(three_cells) >= 2, 'threat': threat, 'col': col}
+
+def batch_move_features(cells, flat):
+    """Shaping features for many boards at once, given (N, 42) cells from the mover's side and each move's flat index"""
+    windows = cells[:, bitboard.WINDOW_INDICES]
+    own_counts = (windows == 1).sum(axis=-1)
+    opponent_counts = (windows == -1).sum(axis=-1)
+    through = bitboard.CELL_WINDOW_TABLE[flat]
+
+    win = (through & (own_counts == 4)).any(axis=1)
+    block = (through & (opponent_counts == 3)).any(axis=1)
+    open_three = through & (own_counts == 3) & (opponent_counts == 0)
+    twos = (through & (own_counts == 2) & (opponent_counts == 0)).sum(axis=1)
+
+    # A fork needs open threes completed by at least two different cells
+    empty_cells = (bitboard.WINDOW_INDICES * (windows == 0)).sum(axis=-1)
+    first = np.where(open_three, empty_cells, 42).min(axis=1)
+    last = np.where(open_three, empty_cells, -1).max(axis=1)
+
+    # Whether the opponent is left with a playable winning cell (empty, with the cell below filled or the floor)
+    filled = cells != 0
+    playable = ~filled & np.concatenate([filled[:, 7:], np.ones((len(cells), 7), dtype=bool)], axis=1)
+    opponent_three = (opponent_counts == 3) & (own_counts == 0)
+    threat = (opponent_three & playable[:, bitboard.WINDOW_INDICES].any(axis=-1)).any(axis=1)
+
+    return {'win': win, 'block': block, 'threes': open_three.sum(axis=1), 'twos': twos,
+            'fork': first < last, 'threat': threat, 'col': flat % 7}
+
+def shaped_reward(features, rich_shaping=False):
+    """Reward for a move's features, for either a single move or a batch, with the richer terms if rich_shaping"""
+    reward = LIVING_RW + BLOCK_RW * features['block']
+    if rich_shaping:
+        threes, twos = features['threes'], features['twos']
+        reward = (reward + THREE_RW * (threes > 0) + TWO_RW * ((threes == 0) & (twos > 0))
+                  + FORK_RW * features['fork'] + THREAT_RW * features['threat'] + CENTER_RW[features['col']])
+    return reward
+
 def calculate_reward(self, action, row, agent_symbol, opponent_symbol):
-    base_reward = -0.5 # Living reward
-    
-    # # Major rewards/penalties for game-ending states
-    # four_connection, four_dir = creates_sequence(self, action, row, agent_symbol, 4)
-    # if four_connection:  # Agent wins
-    #     # if four_dir == 'v':
-    #     #     return 5.0
-    #     # elif four_dir == 'h':
-    #     #     return 10.0
-    #     # else:
-    #     return 15.0
-    
-    # Check if this move blocked an immediate opponent win
-    if blocks_immediate_win(self, action, row, opponent_symbol):
-        base_reward += 3.0  # Significant reward for preventing loss
-    
-    # # Reward for creating winning opportunities
-    # three_connection, three_dir = creates_sequence(self, action, row, agent_symbol, 3, 1)
-    # two_connection, two_dir = creates_sequence(self, action, row, agent_symbol, 2)
-    # if three_connection:
-    #     # if three_dir == 'v':
-    #     #     base_reward += 1.0  # Three in a row is very good, but less rare for vertical
-    #     # elif three_dir == 'h':
-    #     #     base_reward += 2.0  # Three in a row is very good, and in between for horizontal
-    #     # else:
-    #     base_reward += 3.0  # Three in a row is very good, rare for diagonal
-    # elif two_connection:
-    #     base_reward += 0.5  # Two in a row is decent
-        
-    # # Penalty for allowing opponent threats
-    # opp_three_conn, opp_three_dir = creates_sequence(self, action, row, opponent_symbol, 3, 1)
-    # opp_two_conn, opp_two_dir = creates_sequence(self, action, row, opponent_symbol, 2)
-    # if opp_three_conn:
-    #     base_reward -= 3.0  # Heavily penalize allowing three in a row
-    # elif opp_two_conn:
-    #     base_reward -= 0.8  # Penalize allowing two in a row
-    
-    # # Strategic position rewards
-    # if creates_fork(self, action, row, agent_symbol):
-    #     base_reward += 3.0  # Multiple winning threats is very good
-    
-    # # Center control is important
-    # if action == 4:
-    #     base_reward += 0.2
-    # elif action in [3, 5]:  # Adjacent to center
-    #     base_reward += 0.1
-        
-    # # Lower rows are generally better
-    # row_multiplier = (row + 1) / 6  # 1/6 for bottom row, 1 for top row
-    # base_reward *= (2 - row_multiplier)  # Reduces reward for higher plays
-    
-    return base_reward
+    return float(shaped_reward(move_features(self.board, action, row, agent_symbol), self.rich_shaping))
 
 def blocks_immediate_win(self, col, row, opponent_symbol):
     """Check if the move blocks an immediate win for the opponent"""
-    # Temporarily remove our piece
-    self.board.game_board[col][row].update_status(' ')
-    
-    # Check if opponent would win by playing here
-    self.board.game_board[col][row].update_status(opponent_symbol)
-    would_win = self.check_win((col, row), opponent_symbol)
-    
-    # Restore our piece
-    self.board.game_board[col][row].update_status(self.agent_symbol)
-    
-    return would_win
-
-def creates_fork(self, col, row, symbol):
-    """Check if the move creates multiple winning threats"""
-    winning_threats = 0
-    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
-    
-    for dx, dy in directions:
-        three_connected, three_dir = creates_sequence(self, col, row, symbol, 3)
-        if three_connected:
-            winning_threats += 1
-            if winning_threats >= 2:
-                return True
-    
-    return False
+    return move_features(self.board, col, row, self.board.symbols[1 - self.board.symbol_index[opponent_symbol]])['block']
 
 # Training step where the agent has the first move
 def dqn_step_agent_opp(self, action):
@@ -186,13 +191,12 @@ def dqn_step_opp_agent(self, action):
 def agent_step(self, action) -> float:
     self.current_player = self.agent_symbol
 
-    # Heavily penalize invalid moves
-    if action not in self.get_valid_actions():
-        return (-10, action, None)
+    # Heavily penalize invalid moves (never chosen by the masked DQN, see masked_dqn.py)
+    if not self.is_valid_action(action):
+        return (INVALID_RW, action, None)
 
-    # Agent's turn
-    available_row = self.board.available_slot_in_col(action)
-    self.board.game_board[action][available_row].update_status(self.agent_symbol)
+    # Agent's turn (push records a win or draw)
+    available_row = self.push(action)
 
     # Calculate reward for agent's move
     reward = calculate_reward(
@@ -204,14 +208,11 @@ def agent_step(self, action) -> float:
     )
     
     # Check for agent win
-    if self.check_win((action, available_row), self.agent_symbol):
-        self.winner = self.agent_symbol
-        self.game_over = True
+    if self.winner == self.agent_symbol:
         reward += WIN_RW
     
     # Check for draw
     if self.board.is_full():
-        self.game_over = True
         reward = 0
     
     return (reward, action, available_row)
@@ -222,36 +223,26 @@ def opponent_step(self):
 
     # Opponent's turn
     opponent_action = self.opponent.next_move(self.get_valid_actions(), self.get_state(self.opponent_symbol))
-    opponent_row = self.board.available_slot_in_col(opponent_action)
-    self.board.game_board[opponent_action][opponent_row].update_status(self.opponent_symbol)
+    opponent_row = self.push(opponent_action)
     
     # Check for opponent win
-    if self.check_win((opponent_action, opponent_row), self.opponent_symbol):
-        self.winner = self.opponent_symbol
-        self.game_over = True
+    if self.winner == self.opponent_symbol:
         reward = LOSS_RW
     
     # Check for draw
     if self.board.is_full():
-        self.game_over = True
         reward = 0
     
     return (reward, opponent_action, opponent_row)
 
 def get_step_info(self, reward, action, row, override=False):
-    # Getting win direction
-    if action is not None and row is not None:
-        four_connection, four_dir = creates_sequence(self, action, row, self.agent_symbol, 4)
-        if not four_connection:
-            four_connection, four_dir = creates_sequence(self, action, row, self.opponent_symbol, 4)
-    else:
-        four_connection = True
-        four_dir = None
-    
+    # Getting win direction, recorded when the win was detected
+    win_result = self.win_result
+    four_dir = win_result.direction if win_result is not None else None
+
     # Validating win
-    if four_connection is False and self.winner is not None:
-        status = self.board.game_board[action][row].get_status()
-        print("ERROR: Win detected, but four connected pieces not found.", four_connection, self.winner, status)
+    if win_result is None and self.winner is not None:
+        print("ERROR: Win detected, but four connected pieces not found.", self.winner)
 
     # Getting the agent's player number
     player_num = '1' if self.training_agent_is_p1 else '2'
@@ -263,11 +254,15 @@ def get_step_info(self, reward, action, row, override=False):
     tie = True if self.winner == None else False
 
     # Adding info to a dictionary
-    info = {'agent_player_num': player_num, 'agent_win': agent_win, 'tie': tie, 'win_dir': four_dir}
+    info = {'agent_player_num': player_num, 'agent_win': agent_win, 'tie': tie, 'win_dir': four_dir,
+            'win_result': win_result, 'action_mask': self.get_action_mask()}
+
+    # Copying the state, since it is kept by the caller (e.g. as a terminal observation in the replay buffer)
+    state = self.get_state(self.agent_symbol).copy()
 
     # Override used to ensure the game hits the end state
     if override:
-        return self.get_state(self.agent_symbol), reward, True, False, info
+        return state, reward, True, False, info
     
     # Otherwise return like normal
-    return self.get_state(self.agent_symbol), reward, self.game_over, False, info
\ No newline at end of file
+    return state, reward, self.game_over, False, info
\ No newline at end of file
@@ -1,7 +1,12 @@
 import game
-from stable_baselines3.common.callbacks import BaseCallback
-
-def output_stats(wins, losses, ties, num_total_plays, num_games, title):
+import multiprocessing
+import random
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+def output_stats(wins, losses, ties, num_total_plays, num_games, title, elapsed=None):
     width = 40
 
     win_ratio = f'\tWin Ratio: \t | {wins/num_games}'
@@ -14,12 +19,32 @@ def output_stats(wins, losses, ties, num_total_plays, num_games, title):
                 f"| {win_ratio:<{width-13}} |\n" +
                 f"| {loss_ratio:<{width-12}} |\n" +
                 f"| {tie_ratio:<{width-13}} |\n" +
-                f"| {avg_plays:<{width-13}} |\n" +
-                "-"*width)
+                f"| {avg_plays:<{width-13}} |\n")
+
+    # Throughput, when the run was timed
+    if elapsed is not None and elapsed > 0:
+        games_rate = f'\tGames/sec: \t | {num_games/elapsed:.1f}'
+        moves_rate = f'\tMoves/sec: \t | {num_total_plays/elapsed:.1f}'
+        final_str += (f"| {games_rate:<{width-13}} |\n" +
+                      f"| {moves_rate:<{width-13}} |\n")
+
+    final_str += "-"*width
 
     print(final_str)
 
-def get_game_stats(self, num_games):
+# Seeds every generator the players and the game draw from.
+def seed_everything(self, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].manual_seed(seed)
+    self.reset(seed=seed)
+
+# Plays the games and returns the (wins, losses, ties, moves) counts from player 1's point of view.
+def play_games(self, num_games, seed=None):
+    if seed is not None:
+        seed_everything(self, seed)
+
     wins = 0
     losses = 0
     ties = 0
@@ -35,163 +60,85 @@ def get_game_stats(self, num_games):
         else:
             losses += 1
 
-    output_stats(wins, losses, ties, num_total_moves, num_games, "Model vs. Model Evaluation")
-
-class StatTracker(BaseCallback):
-    def __init__(self, verbose=0):
-        super().__init__(verbose)
-        # Tracking total win/losses/ties
-        self.num_agent_wins = 0
-        self.num_opponent_wins = 0
-        self.num_ties = 0
-
-        # Tracking direction of win
-        self.num_agent_v_wins = 0
-        self.num_agent_h_wins = 0
-        self.num_agent_du_wins = 0
-        self.num_agent_dd_wins = 0
-
-        # Tracking opponent's direction for wins
-        self.num_opponent_v_wins = 0
-        self.num_opponent_h_wins = 0
-        self.num_opponent_du_wins = 0
-        self.num_opponent_dd_wins = 0
-
-        # Wins as p1 vs p2
-        self.num_agent_p1_wins = 0
-        self.num_agent_p2_wins = 0
-        self.num_opponent_p1_wins = 0
-        self.num_opponent_p2_wins = 0
-
-    def _on_step(self) -> bool:
-        # Accessing step information
-        dones = self.locals['dones']
-        infos = self.locals['infos']
-
-        # info = {'agent_player_num': player_num, 'agent_win': agent_win, 'tie': tie, 'win_dir': four_dir}
-
-        for i, done in enumerate(dones):
-            if done:
-                info = infos[i]
-                # Check for agent win
-                if info['agent_win']:
-                    self.num_agent_wins += 1
-
-                    # Check for player 1 vs 2 win
-                    if info['agent_player_num'] == '1':
-                        self.num_agent_p1_wins += 1
-                    else:
-                        self.num_agent_p2_wins += 1
-
-                    # Check for vertical win
-                    if info['win_dir'] == 'v':
-                        self.num_agent_v_wins += 1
-
-                    # Check for horizontal win
-                    elif info['win_dir'] == 'h':
-                        self.num_agent_h_wins += 1
-
-                    # Check for upward diagonal
-                    elif info['win_dir'] == 'du':
-                        self.num_agent_du_wins += 1
-
-                    # Check for downward diagonal
-                    elif info['win_dir'] == 'dd':
-                        self.num_agent_dd_wins += 1
-
-                # Otherwise, if a tie
-                elif info['tie']:
-                    self.num_ties += 1
-
-                # Otherwise, opponent win
-                else:
-                    self.num_opponent_wins += 1
-
-                    # Check for player 1 vs 2 win
-                    if info['agent_player_num'] == '1':
-                        self.num_opponent_p2_wins += 1
-                    else:
-                        self.num_opponent_p1_wins += 1
-
-                    # Check for vertical win
-                    if info['win_dir'] == 'v':
-                        self.num_opponent_v_wins += 1
-
-                    # Check for horizontal win
-                    elif info['win_dir'] == 'h':
-                        self.num_opponent_h_wins += 1
-
-                    # Check for upward diagonal
-                    elif info['win_dir'] == 'du':
-                        self.num_opponent_du_wins += 1
-
-                    # Check for downward diagonal
-                    elif info['win_dir'] == 'dd':
-                        self.num_opponent_dd_wins += 1
-
-        return True
-    
-    def reset_stats(self):
-        # Tracking total win/losses/ties
-        self.num_agent_wins = 0
-        self.num_opponent_wins = 0
-        self.num_ties = 0
-
-        # Tracking direction of win
-        self.num_agent_v_wins = 0
-        self.num_agent_h_wins = 0
-        self.num_agent_du_wins = 0
-        self.num_agent_dd_wins = 0
-
-        # Tracking opponent's direction for wins
-        self.num_opponent_v_wins = 0
-        self.num_opponent_h_wins = 0
-        self.num_opponent_du_wins = 0
-        self.num_opponent_dd_wins = 0
-
-        # Wins as p1 vs p2
-        self.num_agent_p1_wins = 0
-        self.num_agent_p2_wins = 0
-        self.num_opponent_p1_wins = 0
-        self.num_opponent_p2_wins = 0
-
-    def output_info(self):
-        width = 40
-        final_str = "-"*width + '\n'
-
-        final_str +=    f'\tAgent Wins: \t | {self.num_agent_wins}' + '\n'
-        final_str +=    f'\tOpp Wins: \t\t | {self.num_opponent_wins}' + '\n'
-        final_str +=    f'\tTotal Ties: \t | {self.num_ties}' + '\n'
-        
-        final_str += '\n'
-
-        final_str +=    f'\tA-V Wins: \t | {self.num_agent_v_wins}' + '\n'
-        final_str +=    f'\tA-H Wins: \t | {self.num_agent_h_wins}' + '\n'
-        final_str +=    f'\tA-DU Wins: \t | {self.num_agent_du_wins}' + '\n'
-        final_str +=    f'\tA-DD Wins: \t | {self.num_agent_dd_wins}' + '\n'
-
-        final_str += '\n'
-
-        final_str +=    f'\tO-V Wins: \t | {self.num_opponent_v_wins}' + '\n'
-        final_str +=    f'\tO-H Wins: \t | {self.num_opponent_h_wins}' + '\n'
-        final_str +=    f'\tO-DU Wins: \t | {self.num_opponent_du_wins}' + '\n'
-        final_str +=    f'\tO-DD Wins: \t | {self.num_opponent_dd_wins}' + '\n'
-        
-        final_str += '\n'
-
-        final_str +=    f'\tA P1 Wins: \t | {self.num_agent_p1_wins}' + '\n'
-        final_str +=    f'\tA P2 Wins: \t | {self.num_agent_p2_wins}' + '\n'
-
-        final_str += '\n'
-
-        final_str +=    f'\tO P1 Wins: \t | {self.num_opponent_p1_wins}' + '\n'
-        final_str +=    f'\tO P2 Wins: \t | {self.num_opponent_p2_wins}' + '\n'
-
-        final_str += "-"*width
-
-        print(final_str)
-
-        return final_str
-
-    # def _on_rollout_end(self):
-    #     self.output_info()
\ No newline at end of file
+    return wins, losses, ties, num_total_moves
+
+# Returns True if the player plays with a Stable Baselines model (a model file, 'dqlsb' or an MCTS player), which
+# needs torch.
+def uses_torch(player):
+    return not (player in ('human', 'random', 'ql', 'dql') or player == 'solver' or player.startswith('solver:')
+                or player.endswith('.npz'))
+
+# Worker process entry point: builds its own game with the given settings and plays a shard of the games.
+def play_shard(settings, num_games, seed):
+    # Workers share the machine, so each keeps torch to a single thread. torch is imported here rather than by the
+    # first model load, so the thread cap is set before any model runs and seed_everything seeds it.
+    if uses_torch(settings['player1']) or uses_torch(settings['player2']):
+        import torch
+        torch.set_num_threads(1)
+
+    shard_game = game.Connect4(mode='evaluate', headless=True, **settings)
+    return play_games(shard_game, num_games, seed)
+
+def get_game_stats(self, num_games, workers=1, seed=None):
+    start = time.time()
+
+    if workers <= 1:
+        wins, losses, ties, num_total_moves = play_games(self, num_games, seed)
+
+    else:
+        # Settings each worker needs to rebuild this game
+        settings = {'player1': self.player1_type, 'player2': self.player2_type, 'player1_symbol': self.player1_symbol,
+                    'player2_symbol': self.player2_symbol, 'starting_player': self.starting_player,
+                    'book_path': self.book_path, 'deterministic': self.deterministic, 'cache_size': self.cache_size}
+
+        # Splitting the games as evenly as possible, with a fixed seed per shard when a seed is given
+        shard_sizes = [num_games // workers + (1 if i < num_games % workers else 0) for i in range(workers)]
+        shard_seeds = [None if seed is None else seed + i for i in range(workers)]
+
+        # Spawned (rather than forked) workers, since the parent may already be running torch threads
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(play_shard, [settings] * workers, shard_sizes, shard_seeds))
+
+        wins, losses, ties, num_total_moves = (sum(counts) for counts in zip(*results))
+
+    elapsed = time.time() - start
+    output_stats(wins, losses, ties, num_total_moves, num_games, "Model vs. Model Evaluation", elapsed)
+
+    return {'wins': wins, 'losses': losses, 'ties': ties, 'moves': num_total_moves, 'games': num_games,
+            'games_per_sec': num_games / elapsed, 'moves_per_sec': num_total_moves / elapsed}
+
+# Returns the score (wins plus half the ties, per game) of a policy given as its Q-network arrays (see
+# export_model.network_arrays) playing its greedy legal move against a fixed opponent, starting half of the games.
+# The games are seeded the same way on every call, so the scores of checkpoints taken during training can be
+# compared, and the random generators are restored afterwards so training isn't affected.
+def policy_score(arrays, opponent='random', num_games=100, seed=0):
+    from agent import NumpyQAgent
+    from numpy_policy import NumpyQNetwork
+
+    eval_game = game.Connect4(mode='evaluate', player1='random', player2=opponent, headless=True)
+    eval_game.player1 = NumpyQAgent(eval_game.player1_symbol, True, NumpyQNetwork(arrays), deterministic=True)
+
+    random_state, np_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    eval_game.reset(seed=seed)
+    try:
+        results = []
+        for starting_player, shard_size in (('player1', (num_games + 1) // 2), ('player2', num_games // 2)):
+            eval_game.starting_player = starting_player
+            results.append(play_games(eval_game, shard_size))
+    finally:
+        random.setstate(random_state)
+        np.random.set_state(np_state)
+
+    wins, losses, ties, _ = (sum(counts) for counts in zip(*results))
+    return (wins + ties / 2) / num_games
+
+# StatTracker is a Stable Baselines3 callback, so it lives in stat_tracker.py and is only imported (along with
+# torch) when it is first used.
+def __getattr__(name):
+    if name == 'StatTracker':
+        from stat_tracker import StatTracker
+        return StatTracker
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,75 @@
+import argparse
+import os
+import numpy as np
+import torch as th
+from torch import nn
+from stable_baselines3 import DQN
+from stable_baselines3.common.torch_layers import FlattenExtractor
+import numpy_policy
+
+# Exports the Q-network of a Stable Baselines3 DQN model to a .npz file that numpy_policy can run without
+# torch, then checks that both give the same Q-values and actions.
+
+
+# Returns the model's Q-network as the arrays numpy_policy.NumpyQNetwork is built from.
+def network_arrays(model):
+    q_net = model.policy.q_net
+    if type(q_net.features_extractor) is not FlattenExtractor:
+        raise ValueError("Only models with the default flatten features extractor can be exported.")
+
+    # Linear layers in order, each with the activation that follows it (if any)
+    weights, biases, activations = [], [], []
+    for module in q_net.q_net:
+        if isinstance(module, nn.Linear):
+            weights.append(module.weight.detach().cpu().numpy())
+            biases.append(module.bias.detach().cpu().numpy())
+            activations.append('Identity')
+        elif type(module).__name__ in numpy_policy.ACTIVATIONS and weights:
+            activations[-1] = type(module).__name__
+        else:
+            raise ValueError(f"Layer {module} can't be exported.")
+
+    arrays = {'num_layers': len(weights), 'activations': np.array(activations),
+              'exploration_rate': model.exploration_rate}
+    arrays.update({f'weight_{i}': weight for i, weight in enumerate(weights)})
+    arrays.update({f'bias_{i}': bias for i, bias in enumerate(biases)})
+    return arrays
+
+
+# Writes the model's Q-network weights to the .npz path.
+def export_model(model, path):
+    np.savez(path, **network_arrays(model))
+
+
+# Compares the exported network with the model on random positions and returns the largest Q-value difference
+# and the number of positions where the chosen actions differ.
+def check_parity(model, network, num_positions=10_000, seed=0):
+    rng = np.random.default_rng(seed)
+    states = rng.integers(-1, 2, size=(num_positions, 6, 7)).astype(np.int8)
+
+    with th.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(states)
+        expected = model.policy.q_net(obs_tensor).cpu().numpy()
+    q_values = network.q_values(states)
+
+    return float(np.abs(q_values - expected).max()), int((q_values.argmax(axis=1) != expected.argmax(axis=1)).sum())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a Stable Baselines3 DQN model to a NumPy .npz file')
+    parser.add_argument('model', type=str,
+                        help='Path to the model .zip file.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Path to write the .npz file to (defaults to the model path with a .npz extension).')
+    parser.add_argument('--positions', type=int, default=10_000,
+                        help='Number of random positions to check the exported network on.')
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.model)[0] + '.npz'
+    model = DQN.load(args.model)
+    export_model(model, output)
+
+    max_diff, mismatches = check_parity(model, numpy_policy.NumpyQNetwork(output), args.positions)
+    print(f"Wrote {output}\tMax Q-value difference: {max_diff:.2e}\tAction mismatches: {mismatches}/{args.positions}")
+    if mismatches:
+        raise SystemExit("ERROR: Exported network does not match the model.")
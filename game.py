@@ -1,11 +1,13 @@
 import numpy as np
+from collections import namedtuple
 import agent
+import bitboard
 import gymnasium as gym
 from gymnasium import spaces
 import time
 import deepq
-import os
-from random import choice
+import opening_book
+from checkpoint import CheckpointManager
 
 # Constants/rewards for reinforcement training
 LOSING_RW = -10
@@ -13,28 +15,54 @@ WINNING_RW = 10
 TIE_RW = 0
 MOVE_RW = -0.1
 
+# Result of a detected win: the winner's symbol, the line's direction ('v', 'h', 'du' or 'dd') and its four (col, row) slots
+WinResult = namedtuple('WinResult', ['winner', 'direction', 'cells'])
+
 # Represents a slot in the Connect 4 board.
+# Slots are views onto the board's bitboards, so reading or updating a slot reads or updates the board itself.
 class Slot:
 
-    def __init__(self):
-        self.status = ' '
+    def __init__(self, board, col, row):
+        self.board = board
+        self.col = col
+        self.row = row
 
     # Updates the status of the slot with the given player symbol.
     def update_status(self, status):
-        self.status = status
+        self.board.set_status(self.col, self.row, status)
 
     # Returns the status of the slot.
     def get_status(self):
-        return str(self.status)
+        return self.board.get_status(self.col, self.row)
 
     def __str__(self):
-        return str(self.status)
+        return self.get_status()
 
 # Represents the Connect 4 board.
+# The pieces are stored as one 64-bit mask per player plus the height of each column,
+# while game_board keeps the old 7x6 array of slots available as a view for the GUI.
+# The board also counts each player's pieces in each of the 69 winning windows, updating only the windows
+# through a cell when a piece is placed or removed, so win and threat queries never rescan the board.
 class Board:
 
-    def __init__(self, headless=False):
+    def __init__(self, headless=False, symbols=('o', 'x')):
         self.headless = headless
+        self.symbols = symbols
+        self.symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+
+        # Slot views never change, so they are built once instead of on every reset
+        self.game_board = np.empty((7, 6), dtype=object)
+        for col in range(7):
+            for row in range(6):
+                self.game_board[col][row] = Slot(self, col, row)
+
+        # Observation buffers (1 own, -1 opponent, 0 empty), one per symbol, updated in place as pieces are placed.
+        # Callers only ever see read-only views of them.
+        self.observations = np.zeros((2, 6, 7), dtype=np.int8)
+        self.observation_views = [self.observations[i].view() for i in range(2)]
+        for view in self.observation_views:
+            view.flags.writeable = False
+
         self.reset_board()
 
     # Prints information about the board.
@@ -55,7 +83,7 @@ class Board:
         for row in range(shape[1]-1, -1, -1):
             row_str = "| "
             for col in range(shape[0]):
-                row_str += self.game_board[col][row].get_status() + " | "
+                row_str += self.get_status(col, row) + " | "
             board_str += row_str + "\n"
 
         # Printing the bottom line
@@ -66,73 +94,263 @@ class Board:
 
     # Resets the board to its initial empty state.
     def reset_board(self):
-        self.game_board = np.array([[Slot() for _ in range(6)] for _ in range(7)])
+        self.bitboards = [0, 0]         # One mask of occupied cells per player symbol
+        self.heights = [0] * 7          # Number of pieces in each column
+        self.legal_mask = bitboard.FULL_LEGAL_MASK  # Bit c is set while column c still has room
+        self.num_moves = 0
+        self.first_index = 0            # Index of the symbol that moved first, which owns Zobrist colour 0
+        self.hash = 0                   # Zobrist hash of the position, updated with every move
+        self.mirror_hash = 0            # Zobrist hash of the position's left-right mirror image
+        self.history = []               # Columns played, in order (edits through set_status are not recorded)
+        self.observations.fill(0)
+
+        # Per-window counts for each player, and the tallies kept from them
+        self.window_counts = [[0] * len(bitboard.WINDOWS) for _ in range(2)]    # Pieces in each window
+        self.fours = [0, 0]             # Windows filled by the player
+        self.open_threes = [0, 0]       # Windows holding three of the player's pieces and one empty cell
+        self.threat_counts = [[0] * (bitboard.WIDTH * bitboard.H1) for _ in range(2)]   # Open threes each cell completes
+
+    # Recounts every window from the bitboards, for edits that can't be applied incrementally.
+    def count_windows(self):
+        mask = self.bitboards[0] | self.bitboards[1]
+        for i in range(2):
+            self.window_counts[i] = [bitboard.popcount(self.bitboards[i] & window) for window in bitboard.WINDOW_MASKS]
+            self.threat_counts[i] = [0] * (bitboard.WIDTH * bitboard.H1)
+        for i in range(2):
+            own, other = self.window_counts[i], self.window_counts[1 - i]
+            self.fours[i] = own.count(4)
+            self.open_threes[i] = 0
+            for w, window in enumerate(bitboard.WINDOW_MASKS):
+                if own[w] == 3 and other[w] == 0:
+                    self.open_threes[i] += 1
+                    self.threat_counts[i][(window & ~mask).bit_length() - 1] += 1
+
+    # Updates the windows through the bit index after player i's piece was placed there.
+    def add_to_windows(self, i, index):
+        own, other = self.window_counts[i], self.window_counts[1 - i]
+        mask = self.bitboards[0] | self.bitboards[1]
+        for w in bitboard.CELL_WINDOWS[index]:
+            count = own[w]
+            own[w] = count + 1
+            if other[w] == 0:
+                if count == 2:
+                    # New open three, completed by the window's remaining empty cell
+                    self.open_threes[i] += 1
+                    self.threat_counts[i][(bitboard.WINDOW_MASKS[w] & ~mask).bit_length() - 1] += 1
+                elif count == 3:
+                    # Open three completed
+                    self.open_threes[i] -= 1
+                    self.fours[i] += 1
+                    self.threat_counts[i][index] -= 1
+            elif count == 0 and other[w] == 3:
+                # Opponent's open three blocked
+                self.open_threes[1 - i] -= 1
+                self.threat_counts[1 - i][index] -= 1
+
+    # Updates the windows through the bit index after player i's piece was removed from there.
+    def remove_from_windows(self, i, index):
+        own, other = self.window_counts[i], self.window_counts[1 - i]
+        mask = self.bitboards[0] | self.bitboards[1] | (1 << index)
+        for w in bitboard.CELL_WINDOWS[index]:
+            count = own[w]
+            own[w] = count - 1
+            if other[w] == 0:
+                if count == 3:
+                    self.open_threes[i] -= 1
+                    self.threat_counts[i][(bitboard.WINDOW_MASKS[w] & ~mask).bit_length() - 1] -= 1
+                elif count == 4:
+                    self.open_threes[i] += 1
+                    self.fours[i] -= 1
+                    self.threat_counts[i][index] += 1
+            elif count == 1 and other[w] == 3:
+                self.open_threes[1 - i] += 1
+                self.threat_counts[1 - i][index] += 1
+
+    # Returns the symbol in the given slot, or ' ' if it is empty.
+    def get_status(self, col, row):
+        bit = bitboard.cell_bit(col, row)
+        for i, mask in enumerate(self.bitboards):
+            if mask & bit:
+                return self.symbols[i]
+        return ' '
+
+    # Writes a symbol (or ' ' to clear) directly into a slot, keeping the column height consistent.
+    def set_status(self, col, row, status):
+        col, row = int(col), int(row)   # Actions may arrive as numpy integers, which must not leak into the masks
+        bit = bitboard.cell_bit(col, row)
+        for i in range(2):
+            if self.bitboards[i] & bit:
+                self.bitboards[i] ^= bit
+                self.num_moves -= 1
+        self.observations[:, 5 - row, col] = 0
+        if status != ' ':
+            i = self.symbol_index[status]
+            self.bitboards[i] |= bit
+            self.num_moves += 1
+            self.observations[i, 5 - row, col] = 1
+            self.observations[1 - i, 5 - row, col] = -1
+
+        # Height is one above the highest filled slot in the column
+        filled = ((self.bitboards[0] | self.bitboards[1]) & bitboard.COLUMN_MASKS[col]) >> (col * bitboard.H1)
+        self.heights[col] = filled.bit_length()
+        if self.heights[col] < 6:
+            self.legal_mask |= 1 << col
+        else:
+            self.legal_mask &= ~(1 << col)
+
+        # Arbitrary edits can't be applied incrementally, so the hash and window counts are recomputed
+        first = self.first_index
+        self.hash = bitboard.zobrist_hash(self.bitboards[first], self.bitboards[1 - first])
+        self.mirror_hash = bitboard.zobrist_hash(bitboard.mirror(self.bitboards[first]), bitboard.mirror(self.bitboards[1 - first]))
+        self.count_windows()
+
+    # Drops a piece for the given symbol into the column and returns the row it landed in.
+    def play(self, col, symbol):
+        col = int(col)  # Actions may arrive as numpy integers, which must not leak into the masks
+        row = self.heights[col]
+        i = self.symbol_index[symbol]
+        if self.num_moves == 0:
+            self.first_index = i
+        self.bitboards[i] |= bitboard.cell_bit(col, row)
+        self.heights[col] = row + 1
+        self.num_moves += 1
+        self.history.append(col)
+        if row == 5:
+            self.legal_mask &= ~(1 << col)
+        index = col * bitboard.H1 + row
+        self.hash ^= bitboard.ZOBRIST_KEYS[i ^ self.first_index][index]
+        self.mirror_hash ^= bitboard.ZOBRIST_KEYS[i ^ self.first_index][bitboard.MIRROR_INDEX[index]]
+        self.add_to_windows(i, index)
+
+        # Only the placed cell changes in each player's observation
+        self.observations[i, 5 - row, col] = 1
+        self.observations[1 - i, 5 - row, col] = -1
+        return row
+
+    # Removes the top piece of the column, undoing the move that placed it, and returns its row.
+    def undo(self, col):
+        col = int(col)
+        row = self.heights[col] - 1
+        bit = bitboard.cell_bit(col, row)
+        i = 0 if self.bitboards[0] & bit else 1
+        self.bitboards[i] ^= bit
+        self.heights[col] = row
+        self.num_moves -= 1
+        self.legal_mask |= 1 << col
+
+        # The column's top piece is its latest entry in the history
+        if self.history and self.history[-1] == col:
+            self.history.pop()
+        elif col in self.history:
+            del self.history[len(self.history) - 1 - self.history[::-1].index(col)]
+        index = col * bitboard.H1 + row
+        self.hash ^= bitboard.ZOBRIST_KEYS[i ^ self.first_index][index]
+        self.mirror_hash ^= bitboard.ZOBRIST_KEYS[i ^ self.first_index][bitboard.MIRROR_INDEX[index]]
+        self.remove_from_windows(i, index)
+        self.observations[:, 5 - row, col] = 0
+        return row
+
+    # Returns the symbol of the player to move, assuming the players alternate from whoever moved first.
+    def symbol_to_move(self):
+        return self.symbols[self.first_index ^ (self.num_moves & 1)]
+
+    # Plays a move that pop() can take back, for the given symbol or the player to move. Returns the row.
+    def push(self, col, symbol=None):
+        return self.play(col, self.symbol_to_move() if symbol is None else symbol)
+
+    # Takes back the last move played and returns its (col, row).
+    def pop(self):
+        col = self.history[-1]
+        return col, self.undo(col)
 
     # Finds the next available slot position for the given column.
     def available_slot_in_col(self, col_index):
-        for row in range(6):
-            if self.game_board[col_index][row].get_status() == ' ':
-                return row
-        return None
+        if not self.legal_mask >> col_index & 1:
+            return None
+        return self.heights[col_index]
     
     # Returns True if the gameboard has been completely filled
     def is_full(self):
-        return all(self.available_slot_in_col(col) is None for col in range(7))
+        return self.num_moves == 42
+
+    # Returns True if the given symbol has four in a row anywhere on the board.
+    def check_win(self, symbol):
+        return self.fours[self.symbol_index[symbol]] > 0
+
+    # Returns the number of open threes (three pieces and an empty cell in one window) the symbol has.
+    def count_open_threes(self, symbol):
+        return self.open_threes[self.symbol_index[symbol]]
+
+    # Returns the columns the symbol would win by playing next.
+    def winning_columns(self, symbol):
+        threats = self.threat_counts[self.symbol_index[symbol]]
+        return [col for col in bitboard.VALID_ACTIONS[self.legal_mask] if threats[col * bitboard.H1 + self.heights[col]]]
+
+    # Returns the WinResult for a four-in-a-row through the slot, or None if there is none.
+    def find_win(self, col, row):
+        for i in range(2):
+            if self.fours[i]:
+                counts = self.window_counts[i]
+                for w in bitboard.CELL_WINDOWS[col * bitboard.H1 + row]:
+                    if counts[w] == 4:
+                        return WinResult(self.symbols[i], *bitboard.WINDOWS[w])
+        return None
+
+    # Returns a read-only 6x7 view of the board from the given symbol's perspective (1 own, -1 opponent, 0 empty).
+    # The view changes as the game goes on, so copy it if it needs to be kept.
+    def get_observation(self, symbol):
+        own = self.symbol_index.get(symbol)
+        if own is None:
+            return -(bitboard.to_array(self.bitboards[0]) + bitboard.to_array(self.bitboards[1]))
+        return self.observation_views[own]
     
 
 # Contains the game logic for Connect 4.
 class Connect4(gym.Env):
 
     def __init__(self, mode='play', player1='human', player2='random', player1_symbol='o', player2_symbol='x', 
-                starting_player='player1', headless=False, episodes=10_000, save_rate=1000):
+                starting_player='player1', headless=False, episodes=10_000, save_rate=1000, book_path=None,
+                deterministic=False, cache_size=0, rich_shaping=False):
         # Setting up gym environment
         super().__init__()
         self.action_space = spaces.Discrete(7)
-        self.observation_space = spaces.Box(low=-1, high=1, shape=(6, 7), dtype=int)
+        self.observation_space = spaces.Box(low=-1, high=1, shape=(6, 7), dtype=np.int8)
         
         # Setting game information
         self.player1_symbol = player1_symbol            # Sets the first player's symbol
         self.player2_symbol = player2_symbol            # Sets the second player's symbol
         self.headless = headless                        # Decides whether to print board
-        self.board = Board(headless=self.headless)      # Sets up board
+        self.board = Board(headless=self.headless, symbols=(player1_symbol, player2_symbol))  # Sets up board
         self.winner = None                              # Stores the winning player's symbol for reference
+        self.win_result = None                          # Stores the WinResult of the winning move
+        self.undo_stack = []                            # State replaced by each pushed move, restored by pop()
         self.game_over = False                          # Boolean for tracking if the game ended
         self.starting_player = starting_player          # Storing the first player for use in resetting
         self.mode = mode                                # String storing either "play" or "train"
         self.episodes = episodes                        # Number of episodes to run for
         self.save_rate = save_rate                      # Saving rate for the RL models during training
         self.training_agent_is_p1 = False               # Value used for swapping agent between player 1 and 2 during training
+        self.opponent_pool = None                       # OpponentPool the training opponent is drawn from on each reset
+        self.rich_shaping = rich_shaping                # Whether training rewards include the richer shaping terms
 
         # Sets the starting symbol (Ex. 'o' or 'x')
         self.current_player = self.player1_symbol if starting_player == 'player1' else self.player2_symbol
 
-        # Replace the human player setup with None instead of HumanPlayer
-        if player1 == 'human':
-            self.player1 = None
-        elif player1 == 'random':
-            self.player1 = agent.RandomAgent(self.player1_symbol, self.headless)
-        elif player1 == 'ql':
-            self.player1 = agent.QLearningAgent(self.player1_symbol, self.headless, mode=mode, game=self)
-        elif player1 == 'dql':
-            self.player1 = agent.DeepQLearningAgent(self.player1_symbol, self.headless, mode=mode, game=self)
-        elif player1 == 'dqlsb':
-            self.player1 = agent.DeepQLearningAgentSB(self.player1_symbol, self.headless, mode=self.mode)
-        else: # Model file
-            self.player1 = agent.DeepQLearningAgentSB(self.player1_symbol, self.headless, mode=mode, model=player1)
-
-        # Same change for player 2
-        if player2 == 'human':
-            self.player2 = None
-        elif player2 == 'random':
-            self.player2 = agent.RandomAgent(self.player2_symbol, self.headless)
-        elif player2 == 'ql':
-            self.player2 = agent.QLearningAgent(self.player2_symbol, self.headless, mode=mode, game=self)
-        elif player2 == 'dql':
-            self.player2 = agent.DeepQLearningAgent(self.player2_symbol, self.headless, mode=mode, game=self)
-        elif player2 == 'dqlsb':
-            self.player2 = agent.DeepQLearningAgentSB(self.player2_symbol, self.headless, mode=self.mode)
-        else: # Model file
-            self.player2 = agent.DeepQLearningAgentSB(self.player2_symbol, self.headless, mode=mode, model=player2)
+        # Setting up the players (None for human players), keeping their types so the game can be rebuilt elsewhere
+        self.deterministic = deterministic              # Whether model players always take their greedy action
+        self.cache_size = cache_size                    # Positions cached per model for deterministic play (0 for none)
+        self.player1_type = player1
+        self.player2_type = player2
+        self.player1 = self.make_player(player1, self.player1_symbol)
+        self.player2 = self.make_player(player2, self.player2_symbol)
+
+        # Sharing the opening book with the players
+        self.book_path = book_path
+        if book_path is not None:
+            book = opening_book.load_book(book_path)
+            for player in (self.player1, self.player2):
+                if player is not None:
+                    player.book = book
 
         # For training with DQN
         if mode == 'train' and (isinstance(self.player1, agent.RLAgent) or isinstance(self.player2, agent.RLAgent)):
@@ -145,6 +363,28 @@ class Connect4(gym.Env):
                 self.opponent_symbol = self.player1_symbol
                 self.opponent = self.player1
 
+    # Builds the player for the given type, or returns None for a human player.
+    def make_player(self, player, symbol):
+        if player == 'human':
+            return None
+        elif player == 'random':
+            return agent.RandomAgent(symbol, self.headless)
+        elif player == 'solver' or player.startswith('solver:'):
+            return agent.SolverAgent.from_spec(symbol, self.headless, player)
+        elif player.startswith('mcts:'):
+            return agent.MCTSAgent.from_spec(symbol, self.headless, self.mode, player)
+        elif player == 'ql':
+            return agent.QLearningAgent(symbol, self.headless, mode=self.mode, game=self)
+        elif player == 'dql':
+            return agent.DeepQLearningAgent(symbol, self.headless, mode=self.mode, game=self)
+        elif player.endswith('.npz'):
+            return agent.NumpyQAgent(symbol, self.headless, player, deterministic=self.deterministic)
+        elif player == 'dqlsb':
+            return agent.DeepQLearningAgentSB(symbol, self.headless, mode=self.mode)
+        else: # Model file
+            return agent.DeepQLearningAgentSB(symbol, self.headless, mode=self.mode, model=player,
+                                              deterministic=self.deterministic, cache_size=self.cache_size)
+
     # Resets the game to the initial state.
     def reset(self, seed=None, options=None):
         # Resetting gym
@@ -153,15 +393,21 @@ class Connect4(gym.Env):
         # Resetting board
         self.board.reset_board()
         self.winner = None
+        self.win_result = None
+        self.undo_stack = []
         self.game_over = False
         self.current_player = self.player1_symbol if self.starting_player == 'player1' else self.player2_symbol
 
-        # Stochastically choosing if agent is p1 or p2 for training
+        # Stochastically choosing if agent is p1 or p2 for training (using the env's seeded generator)
         if self.mode == 'train':
-            self.training_agent_is_p1 = choice([True, False])
+            self.training_agent_is_p1 = bool(self.np_random.integers(2))
+
+            # Drawing this game's opponent from the pool
+            if self.opponent_pool is not None:
+                self.opponent = self.opponent_pool.sample(self.np_random)
 
-        # Returning reset state
-        return self.get_state(), {}
+        # Returning reset state (copied, since the caller keeps it) and the legal columns
+        return self.get_state().copy(), {'action_mask': self.get_action_mask()}
 
     # Executes the given action and updates the game state.
     def step(self, action):
@@ -169,8 +415,8 @@ class Connect4(gym.Env):
         # Setting training flag to avoid consequtive calling of self.mode == 'train'
         training_mode = True if self.mode == 'train' else False
 
-        # Special function for trying out training deep q
-        if training_mode: #and ('dql' in [self.player1, self.player2]):
+        # Special function for trying out training deep q (the 'dql' players are trained by train_game one move at a time)
+        if training_mode and 'dql' not in (self.player1_type, self.player2_type):
             if self.training_agent_is_p1:
                 return deepq.dqn_step_agent_opp(self, action)
             else:
@@ -182,7 +428,7 @@ class Connect4(gym.Env):
         # Game already ended (training mode)
         if training_mode and self.game_over:
             # Prepare the state and info to return
-            state = self.get_state()
+            state = self.get_state().copy()
             done = True
             info = {'current_player': self.current_player}
             truncated = False # Choosing to not limiting the number of steps
@@ -194,9 +440,9 @@ class Connect4(gym.Env):
             raise Exception("Game is over. Please reset the game.")
 
         # Addressing full columns (training)
-        if self.mode == 'train' and action not in self.get_valid_actions():
+        if self.mode == 'train' and not self.is_valid_action(action):
             # Prepare the state and info to return
-            state = self.get_state()
+            state = self.get_state().copy()
             done = False
             info = {'current_player': self.current_player}
             truncated = False # Choosing to not limiting the number of steps
@@ -206,30 +452,26 @@ class Connect4(gym.Env):
         # -------------------------------------------------
 
 
-        # Get the next available slot in the column
-        available_row = self.board.available_slot_in_col(action)
-
         # Validate the action
         if action < 0 or action >= 7:
             raise ValueError(f"Invalid action. Action must be between 1 and 7. Was given {action}.")
-        if available_row is None:
+        if not self.is_valid_action(action):
             raise ValueError("Invalid action. Column is full.")
 
-        # Place the current player's piece in the slot
-        self.board.game_board[action][available_row].update_status(self.current_player)
+        # Place the current player's piece in the next available slot of the column
+        # (push also checks for a win or draw and switches to the other player if the game is not over)
+        mover = self.current_player
+        self.push(action)
 
 
         # -------------- Reward Assignments ---------------
 
         # Check for a win condition
-        if self.check_win((action, available_row), self.current_player):
-            self.winner = self.current_player
-            self.game_over = True
+        if self.winner is not None:
             reward = WINNING_RW
 
         # Check for a draw (if the board is full)
-        elif self.board.is_full():
-            self.game_over = True
+        elif self.game_over:
             reward = TIE_RW
 
         else:
@@ -240,48 +482,75 @@ class Connect4(gym.Env):
 
 
         # Prepare the state and info to return
-        state = self.get_state()
+        state = self.get_state().copy()
         done = self.game_over
-        info = {'current_player': self.current_player}
+        info = {'current_player': mover}
         truncated = False # Choosing to not limiting the number of steps
 
-        # Switch to the other player if the game is not over
-        if not self.game_over:
-            if self.current_player == self.player1_symbol:
-                self.current_player = self.player2_symbol
-            elif self.current_player == self.player2_symbol:
-                self.current_player = self.player1_symbol
-
         return state, reward, done, truncated, info
 
-    # Returns the current state of the game as a numpy array.
+    # Adds a snapshot of the training policy's Q-network arrays to the opponent pool (called through VecEnv.env_method).
+    def add_opponent_snapshot(self, arrays):
+        self.opponent_pool.add_snapshot(arrays)
+
+    # Plays the current player's piece in the column as a move that pop() can take back. Checks for a win or draw
+    # and switches to the other player if the game is not over, like step() does. Returns the row it landed in.
+    def push(self, col):
+        symbol = self.current_player
+        self.undo_stack.append((symbol, self.winner, self.win_result, self.game_over))
+        row = self.board.play(col, symbol)
+
+        if self.check_win((col, row), symbol):
+            self.winner = symbol
+            self.game_over = True
+        elif self.board.is_full():
+            self.game_over = True
+        else:
+            self.current_player = self.player2_symbol if symbol == self.player1_symbol else self.player1_symbol
+        return row
+
+    # Takes back the last pushed move, restoring the winner, game over flag and current player. Returns its (col, row).
+    def pop(self):
+        self.current_player, self.winner, self.win_result, self.game_over = self.undo_stack.pop()
+        return self.board.pop()
+
+    # Returns a key shared by the position and its mirror image: the smaller of their two hashes.
+    # Caches keyed by it store a position and its mirror image once.
+    def canonical_key(self):
+        return min(self.board.hash, self.board.mirror_hash)
+
+    # Returns True if the canonical key is the mirror image's hash, so actions need mirroring to match it.
+    def is_mirrored(self):
+        return self.board.mirror_hash < self.board.hash
+
+    # Returns the column in the mirror image that matches the given column.
+    @staticmethod
+    def mirror_action(action):
+        return 6 - action
+
+    # Maps an action between this position and its canonical form (the mapping is its own inverse).
+    def canonical_action(self, action):
+        return self.mirror_action(action) if self.is_mirrored() else action
+
+    # Returns the current state of the game as a read-only int8 view (copy it to keep it).
     def get_state(self, symbol=None):
         # Default symbol
         if symbol is None: symbol = self.player1_symbol
 
-        # Getting state accordingly
-        state = np.zeros((6, 7), dtype=int)
+        # Own pieces are 1, the opponent's are -1 (rows flipped for standard representation)
+        return self.board.get_observation(symbol)
 
-        # Looping through entire table
-        for col in range(7):
-            for row in range(6):
-
-                # Getting current symbol at each location
-                status = self.board.game_board[col][row].get_status()
+    # Returns a list of valid actions (shared between calls, so it must not be modified)
+    def get_valid_actions(self):
+        return bitboard.VALID_ACTIONS[self.board.legal_mask]
 
-                # Comparing
-                if status == symbol:
-                    state[5 - row][col] = 1  # Flip row index for standard representation
-                elif status == ' ':
-                    state[5 - row][col] = 0  # Flip row index for standard representation
-                else:
-                    state[5 - row][col] = -1
-        return state
+    # Returns a read-only boolean array of length 7 that is True for the valid actions
+    def get_action_mask(self):
+        return bitboard.ACTION_MASKS[self.board.legal_mask]
 
-    # Returns a list of valid actions
-    def get_valid_actions(self):
-        valid_actions = [col for col in range(7) if self.board.available_slot_in_col(col) is not None]
-        return valid_actions
+    # Returns True if the given column can be played
+    def is_valid_action(self, action):
+        return 0 <= action < 7 and bool(self.board.legal_mask >> action & 1)
 
     # Prints the current state of the board to the console or file
     def render(self, file=None):
@@ -291,45 +560,14 @@ class Connect4(gym.Env):
             else:
                 file.write(self.board.__str__())
 
-    # Checks if the current player has won the game after their last move.
+    # Checks if the current player has won the game after their last move, recording the line in win_result.
+    # Only the last move can complete a line, so the board's count of completed lines is checked first
+    # and the line is only looked up (through the last move's slot) when there is one.
     def check_win(self, position, player):
-        col, row = position
-        board = self.board.game_board
-
-        # Directions to check: horizontal, vertical, and two diagonals
-        directions = [
-            (1, 0),  # Horizontal to the right
-            (0, 1),  # Vertical upwards
-            (1, 1),  # Diagonal up-right
-            (1, -1), # Diagonal down-right
-        ]
-
-        for dx, dy in directions:
-            count = 1  # Include the current piece
-
-            # Check in the positive direction
-            for step in range(1, 4):
-                x = col + dx * step
-                y = row + dy * step
-                if 0 <= x < 7 and 0 <= y < 6 and board[x][y].get_status() == player:
-                    count += 1
-                else:
-                    break
-
-            # Check in the negative direction
-            for step in range(1, 4):
-                x = col - dx * step
-                y = row - dy * step
-                if 0 <= x < 7 and 0 <= y < 6 and board[x][y].get_status() == player:
-                    count += 1
-                else:
-                    break
-
-            # Check if four or more in a row
-            if count >= 4:
-                return True
-
-        return False
+        if not self.board.check_win(player):
+            return False
+        self.win_result = self.board.find_win(*position)
+        return True
     
     def play_game(self):
         
@@ -371,19 +609,21 @@ class Connect4(gym.Env):
 
         return num_plays
 
-    def train_game(self, episodes=10000):
+    def train_game(self, episodes=10000, keep_checkpoints=5, eval_opponent='random', eval_games=100):
+        from evaluate import policy_score   # evaluate.py imports this module
 
-        # Setting flags for if a player is a RL model
-        p1_is_rl = True if isinstance(self.player1, agent.RLAgent) else False
-        p2_is_rl = True if isinstance(self.player2, agent.RLAgent) else False
+        # Setting flags for if a player is a NumPy DQN that learns from these games (other RL players only play)
+        p1_is_rl = isinstance(self.player1, agent.DeepQLearningAgent)
+        p2_is_rl = isinstance(self.player2, agent.DeepQLearningAgent)
         
         # Tracking the time for output
         start_time = time.time()
         curr_time = time.time()
 
-        # Create models directory if it doesn't exist
-        if not os.path.exists('models'):
-            os.makedirs('models')
+        # Saving each learning player's models to the models directory (created if it doesn't exist), keeping its
+        # latest keep_checkpoints models and the best by evaluation score (see main.py's --keep_checkpoints)
+        checkpoints = {prefix: CheckpointManager('models', keep_last=keep_checkpoints)
+                       for prefix, is_rl in (('p1', p1_is_rl), ('p2', p2_is_rl)) if is_rl}
 
         # Opening the file
         # Redirecting standard output to output.txt for logging
@@ -404,49 +644,36 @@ class Connect4(gym.Env):
 
                 # Resetting
                 self.reset()
-                prev_action = None
+                prev_moves = {}     # Each player's last state and action
 
                 # Running each game
                 while not self.game_over:
                     
-                    # Getting current state and actions
-                    state = self.get_state()
+                    # Getting the mover's current state (copied, since the RL agents keep it in memory) and actions
+                    symbol = self.current_player
+                    player, is_rl = (self.player1, p1_is_rl) if symbol == self.player1_symbol else (self.player2, p2_is_rl)
+                    state = self.get_state(symbol).copy()
                     actions = self.get_valid_actions()
-                    action = -1
-                    prev_action = action
 
-                    # Getting the next move if playing
-                    if self.current_player == self.player1_symbol:
+                    # Making the next move
+                    action = player.next_move(actions, state)
+                    next_state, reward, done, truncated, info = self.step(action)
+                    prev_moves[symbol] = (state, action)
 
-                        action = self.player1.next_move(actions, state)
-
-                        # Making the next move
-                        next_state, reward, done, truncated, info = self.step(action)
-
-                        # Learning from the action (if applicable)
-                        if p1_is_rl:
-                            self.player1.learn(ep, state, action, reward, next_state, done)
-
-                    else:
-
-                        action = self.player2.next_move(actions, state)
-
-                        # Making the next move
-                        next_state, reward, done, truncated, info = self.step(action)
-
-                        # Learning from the action (if applicable)
-                        if p2_is_rl:
-                            self.player2.learn(ep, state, action, reward, next_state, done)
+                    # Learning from the action (if applicable)
+                    if is_rl:
+                        player.learn(ep, state, action, reward, self.get_state(symbol).copy(), done)
 
                     # Rendering accordingly
                     self.render(_logger)
 
-                # If other player won, notify losing RL model
-                state = self.get_state()
-                if self.current_player == self.player1_symbol and p1_is_rl:
-                    self.player1.learn(ep, state, prev_action, LOSING_RW, state, True)
-                elif self.current_player == self.player2_symbol and p2_is_rl:
-                    self.player2.learn(ep, state, prev_action, LOSING_RW, state, True)
+                # If other player won, notify losing RL model of its last move
+                if self.winner is not None:
+                    loser = self.player2_symbol if self.winner == self.player1_symbol else self.player1_symbol
+                    player, is_rl = (self.player1, p1_is_rl) if loser == self.player1_symbol else (self.player2, p2_is_rl)
+                    if is_rl and loser in prev_moves:
+                        state, action = prev_moves[loser]
+                        player.learn(ep, state, action, LOSING_RW, self.get_state(loser).copy(), True)
 
                 # Updating the model weights after each game
                 batch_size = 32
@@ -469,13 +696,18 @@ class Connect4(gym.Env):
                     else:
                         print(f"Congratulations! Player {self.winner} is the winner!")
 
-                # Saving models occasionally
+                # Saving models occasionally (written in the background, see checkpoint.py), each scored by the same
+                # games against a fixed opponent
                 if ep % self.save_rate == 0:
-                    if p1_is_rl:
-                        self.player1.agent.save("models/p1_dql_" + str(ep) + ".weights.h5")
-
-                    if p2_is_rl:
-                        self.player2.agent.save("models/p2_dql_" + str(ep) + ".weights.h5")
+                    for prefix, player in (('p1', self.player1), ('p2', self.player2)):
+                        if prefix in checkpoints:
+                            score = policy_score(player.agent.arrays(), eval_opponent, eval_games)
+                            checkpoints[prefix].save(player.agent.save, prefix + "_dql_" + str(ep) + ".npz", score=score)
+                            _logger.write(f"Saved {prefix}_dql_{ep}.npz\tEvaluation score vs. {eval_opponent}: {score:.3f}\n")
+
+        # Waiting for the last models to be written
+        for manager in checkpoints.values():
+            manager.close()
     
     def close(self):
         pass
\ No newline at end of file
@@ -0,0 +1,92 @@
+import eventlet
+import numpy as np
+from eventlet.event import Event
+import masked_dqn
+import model_registry
+
+# Micro-batched model inference for the web server (run.py).
+# AI moves requested by different sessions playing the same model are collected for a short window,
+# then answered together with one forward pass of the model's Q-network.
+
+
+# Collects greedy-action requests (best legal column) for one model and answers them in batches.
+# Requests wait at most window_ms (plus the forward pass) before being answered, and a batch is run
+# straight away once max_batch requests are waiting.
+class InferenceDispatcher:
+
+    def __init__(self, model, window_ms=3.0, max_batch=32):
+        self.model = model                  # Loaded Stable Baselines3 DQN
+        self.policy = model.policy
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending = []                   # (observation, event) pairs waiting for the next batch
+        self.timer = None                   # Green thread that runs the batch when the window closes
+        self.reset_stats()
+
+    # Clears the request/batch counters.
+    def reset_stats(self):
+        self.requests = 0       # Requests answered by the model
+        self.batches = 0        # Forward passes run
+        self.explored = 0       # Requests answered with a random action instead
+
+    # Returns the counters as a dictionary.
+    def stats(self):
+        return {'requests': self.requests, 'batches': self.batches, 'explored': self.explored,
+                'mean_batch': self.requests / self.batches if self.batches else 0.0}
+
+    # Returns the model's action for the observation, waiting (without blocking other green threads)
+    # until its batch has been run. Non-deterministic requests explore like DQN.predict does.
+    def predict(self, obs, deterministic=True):
+        if not deterministic and np.random.rand() < self.model.exploration_rate:
+            self.explored += 1
+            return int(masked_dqn.random_legal_actions(obs)[0])
+
+        done = Event()
+        self.pending.append((np.asarray(obs), done))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = eventlet.spawn_after(self.window, self.flush)
+        return done.wait()
+
+    # Runs every waiting request through the Q-network at once and hands each one its action.
+    def flush(self):
+        # Taking the batch before cancelling the timer, since cancelling can switch to other green threads
+        batch, self.pending = self.pending, []
+        timer, self.timer = self.timer, None
+        if timer is not None and timer is not eventlet.getcurrent():
+            timer.cancel()
+        if not batch:
+            return
+
+        try:
+            actions = masked_dqn.greedy_actions(self.policy, np.stack([obs for obs, _ in batch]))
+        except Exception as error:
+            for _, done in batch:
+                done.send_exception(error)
+            return
+
+        self.requests += len(batch)
+        self.batches += 1
+        for (_, done), action in zip(batch, actions):
+            done.send(int(action))
+
+
+# Dispatchers by model file (as registered in the model registry), so every session playing the same model shares one.
+# A dispatcher is dropped when the registry drops its model, so it never outlives it or answers for an older version.
+dispatchers = {}
+
+
+# Returns the shared dispatcher for the model registered under the key, creating it from the loaded model on first use.
+def get_dispatcher(key, model, window_ms=3.0, max_batch=32):
+    if key not in dispatchers:
+        dispatchers[key] = InferenceDispatcher(model, window_ms, max_batch)
+    return dispatchers[key]
+
+
+# Drops the dispatcher of a model dropped by the registry.
+def drop_dispatcher(key):
+    dispatchers.pop(key, None)
+
+
+model_registry.registry.on_drop.append(drop_dispatcher)
@@ -1,11 +1,58 @@
 import argparse
+import random
 import sys
-from stable_baselines3 import DQN  # Import DQN algorithm
 from game import Connect4
 from math import floor
-from evaluate import get_game_stats, StatTracker
+from evaluate import get_game_stats
+
+# Stable Baselines3 (and torch) is only imported when training, since it takes seconds to load
 # from stable_baselines3.common.env_checker import check_env
 
+# Returns the pool of self-play opponents for the game's training opponent: past versions of the policy
+# (added while training) and the --pool_baselines players
+def make_opponent_pool(args, game):
+    from opponent_pool import OpponentPool
+
+    baselines = [game.make_player(player, game.opponent_symbol) for player in args.pool_baselines]
+    return OpponentPool(baselines, max_snapshots=args.pool_size, symbol=game.opponent_symbol, headless=True)
+
+# Returns a function that builds one training game inside a subprocess worker
+def make_worker_env(args, player1, player2, rank, seed):
+    def init_env():
+        from stable_baselines3.common.utils import set_random_seed
+
+        # Forked workers start with copies of the parent's generators, so each one is reseeded
+        set_random_seed(seed + rank)
+
+        # Each worker builds its own game, and with it its own opponent
+        env = Connect4(mode=args.mode, player1=player1, player2=player2, player1_symbol=args.p1_symbol,
+                    player2_symbol=args.p2_symbol, starting_player=args.start, headless=True, episodes=args.episodes,
+                    save_rate=args.save_rate, rich_shaping=args.rich_shaping)
+        if args.iterative:
+            env.opponent_pool = make_opponent_pool(args, env)
+        env.reset(seed=seed + rank)
+        return env
+    return init_env
+
+# Returns the environment to train on, running n_envs games at once with the chosen backend when more than one is requested
+def make_training_env(args, game, player1, player2):
+    if args.n_envs == 1:
+        if args.iterative:
+            game.opponent_pool = make_opponent_pool(args, game)
+        return game
+
+    from stable_baselines3.common.vec_env import SubprocVecEnv, VecMonitor
+    from vec_env import Connect4VecEnv
+
+    if args.vec_backend == 'subproc':
+        seed = args.seed if args.seed is not None else random.randrange(2**31)
+        env_fns = [make_worker_env(args, player1, player2, rank, seed) for rank in range(args.n_envs)]
+        return VecMonitor(SubprocVecEnv(env_fns))
+
+    opponent_pool = make_opponent_pool(args, game) if args.iterative else None
+    return VecMonitor(Connect4VecEnv(args.n_envs, opponent=game.opponent, seed=args.seed, opponent_pool=opponent_pool,
+                                     rich_shaping=args.rich_shaping))
+
 def main():
     parser = argparse.ArgumentParser(description='Connect4 Game')
 
@@ -21,19 +68,49 @@ def main():
     parser.add_argument('--episodes', type=int, default=10_000,
                         help='Give a number representing the number of games during training.')
     parser.add_argument('--iterative', action='store_true',
-                        help='Trains model against newest saved model.')
+                        help='Trains the model against a pool of its own past versions (taken every save_rate steps) and the --pool_baselines players.')
+    parser.add_argument('--pool_size', type=int, default=5,
+                        help='Number of past versions of the model kept as opponents with --iterative.')
+    parser.add_argument('--pool_baselines', type=str, nargs='+', default=['random', 'solver:2'],
+                        help='Players kept as opponents alongside the past versions of the model with --iterative.')
+    parser.add_argument('--n_envs', type=int, default=1,
+                        help='Number of games to train on at once.')
+    parser.add_argument('--vec_backend', type=str, default='native', choices=['native', 'subproc'],
+                        help='How to run multiple games: "native" steps them together in NumPy, "subproc" runs one Connect4 per worker process.')
+    parser.add_argument('--mirror_replay', action='store_true',
+                        help='Also store the mirror image of every training transition in the replay buffer.')
+    parser.add_argument('--prioritized_replay', action='store_true',
+                        help='Replay training transitions in proportion to their last TD error instead of uniformly.')
+    parser.add_argument('--rich_shaping', action='store_true',
+                        help='Adds the richer reward shaping terms (open twos and threes, forks, threats left to the opponent, center columns) to the training rewards.')
+    parser.add_argument('--keep_checkpoints', type=int, default=5,
+                        help='Number of the latest saved models kept during training, besides the one with the best evaluation score (0 keeps every model).')
+    parser.add_argument('--eval_opponent', type=str, default='random',
+                        help='Fixed opponent each saved model plays to score it, picking the best model kept during training.')
+    parser.add_argument('--eval_games', type=int, default=100,
+                        help='Number of games each saved model plays against --eval_opponent to score it.')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Random seed for the training or evaluation games. Each worker uses this seed plus its index.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to play evaluation games in.')
     
     # Choosing players' information
     parser.add_argument('--player1', type=str, default='human',
-                        help='Choose who is playing as the first player: "human", "random", "heuristic", "dql", "dqlsb", or the model file.')
+                        help='Choose who is playing as the first player: "human", "random", "solver" (or "solver:DEPTH", "solver:SECONDSs"), "mcts:MODEL" (or "mcts:MODEL:SIMULATIONS", "mcts:MODEL:SECONDSs"), "dql", "dqlsb", or the model file (.zip, or .npz exported with export_model.py).')
     parser.add_argument('--player2', type=str, default='random',
-                        help='Choose who is playing as the second player: "human", "random", "heuristic", "dql", "dqlsb", or the model file.')
+                        help='Choose who is playing as the second player: "human", "random", "solver" (or "solver:DEPTH", "solver:SECONDSs"), "mcts:MODEL" (or "mcts:MODEL:SIMULATIONS", "mcts:MODEL:SECONDSs"), "dql", "dqlsb", or the model file (.zip, or .npz exported with export_model.py).')
     parser.add_argument('--p1_symbol', type=str, default='o',
                         help='Choose your symbol: "o", "x", or another character.')
     parser.add_argument('--p2_symbol', type=str, default='x',
                         help='Choose your symbol: "o", "x", or another character.')
     parser.add_argument('--start', type=str, default='player1', choices=['player1', 'player2'],
                         help='Choose who starts first: "player1" or "player2".')
+    parser.add_argument('--opening_book', type=str, default=None,
+                        help='Path to an opening book (built with opening_book.py) that agents consult for early moves.')
+    parser.add_argument('--deterministic', action='store_true',
+                        help='Model players always take their greedy action instead of exploring.')
+    parser.add_argument('--cache_size', type=int, default=100_000,
+                        help='Positions whose model action is cached during deterministic play (0 to disable).')
 
     # ------- Validation -------
 
@@ -60,20 +137,43 @@ def main():
         print("ERROR: Saving rate exceeds the number of training episodes.")
         sys.exit()
 
+    if args.n_envs < 1:
+        print("ERROR: n_envs must be at least 1.")
+        sys.exit()
+
+    if args.pool_size < 1:
+        print("ERROR: pool_size must be at least 1.")
+        sys.exit()
+
     # -------------------------
 
     # Init with given args
-    tracker = StatTracker()
     game = Connect4(mode=args.mode, player1=args.player1, player2=args.player2, player1_symbol=args.p1_symbol,
                     player2_symbol=args.p2_symbol, starting_player=args.start, headless=args.headless, episodes=args.episodes, 
-                    save_rate=args.save_rate)
+                    save_rate=args.save_rate, book_path=args.opening_book, deterministic=args.deterministic,
+                    cache_size=args.cache_size, rich_shaping=args.rich_shaping)
 
     # If training Deep Q-Learning Agent
     if args.mode == 'train' and not (args.player1 == 'dql' or args.player2 == 'dql'):
+        from masked_dqn import MaskedDQN  # DQN algorithm that only plays legal columns
+        from replay import MirroredReplayBuffer, PrioritizedReplayBuffer, MirroredPrioritizedReplayBuffer
+        from stat_tracker import StatTracker
+        from export_model import network_arrays
+        from checkpoint import CheckpointManager
+        from evaluate import policy_score
+
+        # Choosing the replay buffer (None for the default one)
+        replay_buffer_class = {(False, False): None, (True, False): MirroredReplayBuffer,
+                               (False, True): PrioritizedReplayBuffer,
+                               (True, True): MirroredPrioritizedReplayBuffer}[args.mirror_replay, args.prioritized_replay]
+
+        # Tracking the games' results during training
+        tracker = StatTracker()
+
         # Create the DQN agent, good parameters
-        model = DQN(
+        model = MaskedDQN(
             'MlpPolicy', 
-            game, 
+            make_training_env(args, game, args.player1, args.player2), 
             learning_rate=0.001,
             buffer_size=100000,
             learning_starts=1000,
@@ -81,39 +181,45 @@ def main():
             gamma=0.99,
             verbose=1,
             exploration_fraction=0.5,
+            replay_buffer_class=replay_buffer_class,
+            beta_timesteps=args.episodes,
         )
         
+        # Saving the models from a background thread, keeping the latest ones and the best by evaluation score
+        checkpoints = CheckpointManager('models', keep_last=args.keep_checkpoints)
+
         for i in range(floor(args.episodes/args.save_rate)):
             # Train the agent
             model.learn(total_timesteps=args.save_rate, callback=tracker)
 
-            # Save the agent
-            new_model_str = f'models/new{i+1}-v2.zip'
-            model.save(new_model_str)
+            # Save the agent, scored by the same games against a fixed opponent every time (the training games'
+            # win rate depends on the opponents drawn)
+            arrays = network_arrays(model)
+            score = policy_score(arrays, args.eval_opponent, args.eval_games)
+            checkpoints.save(model.save, f'new{i+1}-v2.zip', score=score)
 
-            # Updating players for iterative strategy
+            # Adding the current policy to the opponent pools of the running games for iterative strategy
             if args.iterative:
-                new_game = Connect4(mode=args.mode, player1=new_model_str, player2=new_model_str, player1_symbol=args.p1_symbol,
-                    player2_symbol=args.p2_symbol, starting_player=args.start, headless=args.headless, episodes=args.episodes, 
-                    save_rate=args.save_rate)
-                model.set_env(new_game)
+                model.get_env().env_method('add_opponent_snapshot', arrays)
         
-            output_str = tracker.output_info()
+            output_str = tracker.output_info() + f"\nEvaluation score vs. {args.eval_opponent}: {score:.3f}"
             with open('output.txt', "a") as file:
                 file.write(output_str + "\n")
             tracker.reset_stats()
 
+        # Waiting for the last models to be written
+        checkpoints.close()
+
     elif args.mode == 'train' and (args.player1 == 'dql' or args.player2 == 'dql'):
-        print("Training for 'dql' is no longer supported.")
-        sys.exit()
-        game.train_game(args.episodes)
+        # Training the NumPy DQN players one move at a time
+        game.train_game(args.episodes, args.keep_checkpoints, args.eval_opponent, args.eval_games)
 
     elif args.mode == 'play':
         # Running play mode
         game.play_game()
 
     elif args.mode == 'evaluate':
-        get_game_stats(game, args.episodes)
+        get_game_stats(game, args.episodes, workers=args.workers, seed=args.seed)
 
 if __name__ == '__main__':
     # env = Connect4()
@@ -0,0 +1,150 @@
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import DQN
+from stable_baselines3.dqn.policies import DQNPolicy, QNetwork
+import bitboard
+from replay import PrioritizedReplayBuffer
+
+# DQN that only ever considers legal columns.
+# The legal columns are read from the observation itself (a column is legal while its top cell is empty), so the
+# policy needs nothing besides the board: greedy actions, exploration (including the warm-up before learning starts)
+# and the maximum over next Q-values in the TD target all skip full columns. No training step is spent on an
+# illegal move, and the target never bootstraps from a column that can't be played.
+# With a PrioritizedReplayBuffer, each sample's loss is weighted by its importance-sampling weight and its TD error
+# becomes its new priority. The importance-sampling exponent beta rises to 1 over beta_timesteps, counted across every
+# learn call (which resets num_timesteps by default), or over each learn call when no budget is given.
+
+# Q-value given to illegal columns (finite, so masked values times a zero still give zero)
+ILLEGAL_Q = -1e9
+
+
+# Returns the Q-values with the illegal columns of each observation set to ILLEGAL_Q.
+def mask_q_values(q_values, obs):
+    return q_values.masked_fill(~bitboard.observation_action_mask(obs), ILLEGAL_Q)
+
+
+# Returns a uniformly random legal column for each observation in the batch.
+def random_legal_actions(obs):
+    mask = bitboard.observation_action_mask(np.asarray(obs))
+    return (np.random.rand(*mask.shape) * mask).argmax(axis=1)
+
+
+# Returns the legal column with the highest Q-value for each observation in the batch, for any DQN policy
+# (including models trained without masking).
+def greedy_actions(policy, obs):
+    with th.no_grad():
+        obs_tensor, _ = policy.obs_to_tensor(np.asarray(obs))
+        q_values = mask_q_values(policy.q_net(obs_tensor), obs_tensor)
+    return q_values.argmax(dim=1).cpu().numpy()
+
+
+# Q-network whose greedy action is the best legal column.
+class MaskedQNetwork(QNetwork):
+
+    def _predict(self, observation, deterministic=True):
+        return mask_q_values(self(observation), observation).argmax(dim=1).reshape(-1)
+
+
+class MaskedDQNPolicy(DQNPolicy):
+
+    def make_q_net(self):
+        # Make sure we always have separate networks for features extractors etc
+        net_args = self._update_features_extractor(self.net_args, features_extractor=None)
+        return MaskedQNetwork(**net_args).to(self.device)
+
+
+# Stable Baselines3 DQN with legal-action masking. Saved models load with DQN.load as well, keeping the masked policy.
+class MaskedDQN(DQN):
+
+    policy_aliases = {'MlpPolicy': MaskedDQNPolicy}
+
+    def __init__(self, *args, beta_timesteps=None, **kwargs):
+        self.beta_timesteps = beta_timesteps    # Timesteps over which prioritized replay's beta rises to 1
+        self.earlier_timesteps = 0              # Timesteps of earlier learn calls, no longer in num_timesteps
+        super().__init__(*args, **kwargs)
+
+    # Returns the timesteps trained over every learn call so far.
+    def trained_timesteps(self):
+        return self.earlier_timesteps + self.num_timesteps
+
+    # Keeps the timesteps of the previous learn call before a new one resets num_timesteps.
+    def _setup_learn(self, total_timesteps, callback=None, reset_num_timesteps=True, tb_log_name='run',
+                     progress_bar=False):
+        if reset_num_timesteps:
+            self.earlier_timesteps += self.num_timesteps
+        return super()._setup_learn(total_timesteps, callback, reset_num_timesteps, tb_log_name, progress_bar)
+
+    # Epsilon-greedy like DQN.predict, but exploring over the legal columns only.
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        if not deterministic and np.random.rand() < self.exploration_rate:
+            action = random_legal_actions(observation)
+            if not self.policy.is_vectorized_observation(observation):
+                action = action[0]
+            return action, state
+        return self.policy.predict(observation, state, episode_start, deterministic)
+
+    # Warm-up actions (before learning_starts) are random legal columns instead of random columns.
+    def _sample_action(self, learning_starts, action_noise=None, n_envs=1):
+        if self.num_timesteps < learning_starts:
+            action = random_legal_actions(self._last_obs)
+            return action, action
+        return super()._sample_action(learning_starts, action_noise, n_envs)
+
+    # DQN.train with the target's maximum taken over the legal columns of the next observation, and prioritized replay.
+    def train(self, gradient_steps, batch_size=100):
+        # Switch to train mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(True)
+        # Update learning rate according to schedule
+        self._update_learning_rate(self.policy.optimizer)
+
+        # Raising the importance-sampling correction of prioritized replay linearly to 1 over training
+        prioritized = isinstance(self.replay_buffer, PrioritizedReplayBuffer)
+        if prioritized:
+            if self.beta_timesteps:
+                progress = min(1.0, self.trained_timesteps() / self.beta_timesteps)
+            else:
+                progress = 1 - self._current_progress_remaining
+            beta_start = self.replay_buffer.beta_start
+            self.replay_buffer.beta = beta_start + (1 - beta_start) * progress
+
+        losses = []
+        for _ in range(gradient_steps):
+            # Sample replay buffer
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+
+            with th.no_grad():
+                # Compute the next Q-values using the target network, over the legal columns only
+                next_q_values = mask_q_values(self.q_net_target(replay_data.next_observations),
+                                              replay_data.next_observations)
+                next_q_values, _ = next_q_values.max(dim=1)
+                next_q_values = next_q_values.reshape(-1, 1)
+                # 1-step TD target
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            # Get the current Q-values estimates for the actions from the replay buffer
+            current_q_values = th.gather(self.q_net(replay_data.observations), dim=1,
+                                         index=replay_data.actions.long())
+
+            # Compute Huber loss (less sensitive to outliers), weighting the samples and updating their priorities
+            # with prioritized replay
+            if prioritized:
+                sample_losses = F.smooth_l1_loss(current_q_values, target_q_values, reduction='none')
+                loss = (replay_data.weights * sample_losses).mean()
+                td_errors = (current_q_values - target_q_values).detach().cpu().numpy().ravel()
+                self.replay_buffer.update_priorities(replay_data.indices, td_errors)
+            else:
+                loss = F.smooth_l1_loss(current_q_values, target_q_values)
+            losses.append(loss.item())
+
+            # Optimize the policy, clipping the gradient norm
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+        # Increase update counter
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
@@ -0,0 +1,88 @@
+import os
+from collections import OrderedDict
+
+# Process-wide registry of loaded Stable Baselines3 models.
+# Each model file is loaded once, the first time a player needs it, and the same read-only model is shared
+# by every game and session in the process. Models are keyed by absolute path and modification time, so a
+# file that is overwritten (e.g. by training) is loaded fresh, and the least recently used models are
+# dropped once more than max_models are held. Anything kept per model elsewhere (dispatchers, inference caches) is
+# keyed the same way and dropped along with its model through on_drop. Stable Baselines3 (and torch) is only
+# imported when the first model is loaded.
+
+
+class ModelRegistry:
+
+    def __init__(self, max_models=8, loader=None):
+        self.max_models = max_models
+        self.loader = loader            # Function loading a model from a path (DQN.load when None)
+        self.models = OrderedDict()     # (path, mtime) -> model, least recently used first
+        self.on_drop = []               # Functions called with the key of each model dropped (replaced, evicted or cleared)
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.models)
+
+    # Clears the load/hit/eviction counters.
+    def reset_stats(self):
+        self.loads = 0          # Models loaded from disk
+        self.hits = 0           # Requests answered by an already loaded model
+        self.evictions = 0      # Models dropped to stay within max_models
+
+    # Returns the counters as a dictionary.
+    def stats(self):
+        return {'models': len(self.models), 'max_models': self.max_models, 'loads': self.loads, 'hits': self.hits,
+                'evictions': self.evictions}
+
+    # Drops every loaded model.
+    def clear(self):
+        for key in list(self.models):
+            self.drop(key)
+
+    # Drops the model and tells the on_drop functions.
+    def drop(self, key):
+        del self.models[key]
+        for function in self.on_drop:
+            function(key)
+
+    # Returns the key the model file is registered under: its absolute path and modification time.
+    def key(self, path):
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    # Returns the shared model for the file, loading it if it isn't loaded (or has changed on disk).
+    def get(self, path):
+        key = self.key(path)
+        model = self.models.get(key)
+        if model is not None:
+            self.models.move_to_end(key)
+            self.hits += 1
+            return model
+
+        # Loading the model for inference only, so it can be shared safely
+        if self.loader is None:
+            from stable_baselines3 import DQN
+            self.loader = DQN.load
+        model = self.loader(key[0])
+        model.policy.set_training_mode(False)
+        for param in model.policy.parameters():
+            param.requires_grad_(False)
+        self.loads += 1
+
+        # Older versions of the same file are dropped straight away
+        for old_key in [old_key for old_key in self.models if old_key[0] == key[0]]:
+            self.drop(old_key)
+
+        self.models[key] = model
+        while len(self.models) > self.max_models:
+            self.drop(next(iter(self.models)))
+            self.evictions += 1
+        return model
+
+
+# Registry shared by every player in the process
+registry = ModelRegistry()
+
+
+# Returns the shared model for the file.
+def load_model(path):
+    return registry.get(path)
@@ -0,0 +1,59 @@
+import numpy as np
+import bitboard
+
+# Q-networks exported from Stable Baselines3 DQN models (see export_model.py), run with NumPy only.
+# The .npz file holds the weight and bias of each linear layer (weight_0, bias_0, ...), the activation
+# applied after each layer, and the model's exploration rate.
+
+ACTIVATIONS = {
+    'Identity': lambda x: x,
+    'ReLU': lambda x: np.maximum(x, 0),
+    'Tanh': np.tanh,
+    'Sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'ELU': lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    'LeakyReLU': lambda x: np.where(x > 0, x, 0.01 * x),
+}
+
+# Networks that have been loaded, by path, so every game in a process shares one copy
+loaded_networks = {}
+
+
+# Multi-layer perceptron mapping flattened observations to one Q-value per column.
+# Built from a .npz path, or from a dictionary of the same arrays (see export_model.network_arrays).
+class NumpyQNetwork:
+
+    def __init__(self, source):
+        if isinstance(source, dict):
+            self.load_arrays(source)
+        else:
+            with np.load(source) as data:
+                self.load_arrays(data)
+
+    # Copies the layers out of the arrays.
+    def load_arrays(self, data):
+        num_layers = int(data['num_layers'])
+        self.weights = [np.array(data[f'weight_{i}'], dtype=np.float32) for i in range(num_layers)]
+        self.biases = [np.array(data[f'bias_{i}'], dtype=np.float32) for i in range(num_layers)]
+        self.activation_names = [str(name) for name in data['activations']]
+        self.exploration_rate = float(data['exploration_rate'])
+        self.activations = [ACTIVATIONS[name] for name in self.activation_names]
+        self.input_size = self.weights[0].shape[1]
+
+    # Returns the Q-values for a single observation or a batch of them, shape (N, 7).
+    def q_values(self, obs):
+        x = np.asarray(obs, dtype=np.float32).reshape(-1, self.input_size)
+        for weight, bias, activation in zip(self.weights, self.biases, self.activations):
+            x = activation(x @ weight.T + bias)
+        return x
+
+    # Returns the greedy action for each observation, among its legal columns.
+    def predict(self, obs):
+        obs = np.asarray(obs)
+        return np.where(bitboard.observation_action_mask(obs), self.q_values(obs), -np.inf).argmax(axis=1)
+
+
+# Returns the network at the given path, loading it on first use.
+def load_network(path):
+    if path not in loaded_networks:
+        loaded_networks[path] = NumpyQNetwork(path)
+    return loaded_networks[path]
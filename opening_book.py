@@ -0,0 +1,127 @@
+import argparse
+import os
+import time
+import numpy as np
+import bitboard
+import solver
+
+# File layout: a 16 byte header (magic, format version, deepest ply stored, reserved) followed by
+# records sorted by position hash. Positions are stored once per mirror pair, under their canonical hash
+# (the smaller of the hash and the mirror image's hash) and with the move as seen in that canonical form.
+MAGIC = b'C4BOOK'
+VERSION = 2
+HEADER_BYTES = 16
+RECORD = np.dtype([('key', '<u8'), ('move', 'u1'), ('score', '<i2')])
+
+# Books that have been loaded, by path, so every game in a process shares one mapping
+loaded_books = {}
+
+
+# Sorted table of best moves for early positions, memory-mapped from a file built by build_book.
+class OpeningBook:
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_BYTES)
+        if header[:6] != MAGIC or header[6] != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} opening book.")
+        self.max_ply = header[7]
+
+        self.records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_BYTES)
+        self.keys = self.records['key']
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    # Returns (move, score) stored for the canonical position hash, or None.
+    def lookup(self, key):
+        i = np.searchsorted(self.keys, np.uint64(key))
+        if i < len(self.keys) and self.keys[i] == key:
+            self.hits += 1
+            record = self.records[i]
+            return int(record['move']), int(record['score'])
+        self.misses += 1
+        return None
+
+    # Returns the book move for an observation of the player to move (1 own, -1 opponent), or None.
+    def lookup_state(self, curr_state):
+        # Positions deeper than the book are skipped without hashing
+        if np.count_nonzero(curr_state) > self.max_ply:
+            return None
+        key, mirrored = solver.Position.from_state(curr_state).canonical()
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        return bitboard.WIDTH - 1 - entry[0] if mirrored else entry[0]
+
+
+# Returns the book at the given path, mapping it on first use.
+def load_book(path):
+    if path not in loaded_books:
+        loaded_books[path] = OpeningBook(path)
+    return loaded_books[path]
+
+
+# Returns every position reachable in at most max_ply moves where nobody has won yet, without duplicates
+# and with one of each mirror pair.
+def enumerate_positions(max_ply):
+    layer = {0: solver.Position()}
+    positions = []
+    for ply in range(max_ply + 1):
+        positions.extend(layer.values())
+        if ply == max_ply:
+            break
+
+        # Expanding each position by every move that does not end the game
+        next_layer = {}
+        for position in layer.values():
+            for col in range(bitboard.WIDTH):
+                if position.can_play(col) and not position.is_winning_move(col):
+                    child = solver.Position(position.current, position.mask)
+                    child.play(col)
+                    next_layer[child.canonical()[0]] = child
+        layer = next_layer
+    return positions
+
+
+# Solves every position up to max_ply moves and writes the sorted book to path.
+def build_book(path, max_ply=4, depth=10, table_mb=64, verbose=True):
+    positions = enumerate_positions(max_ply)
+    search = solver.Solver(max_depth=depth, table_mb=table_mb)
+
+    records = np.zeros(len(positions), dtype=RECORD)
+    start = time.time()
+    for i, position in enumerate(positions):
+        move, score = search.search(position)
+        key, mirrored = position.canonical()
+        records[i] = (key, bitboard.WIDTH - 1 - move if mirrored else move, score)
+        if verbose and (i + 1) % 100 == 0:
+            print(f"Solved {i + 1}/{len(positions)} positions\tTime Elapsed: {time.time() - start:.2f}")
+
+    records.sort(order='key')
+
+    # Writing to a temporary file first so a half-written book is never loaded
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC + bytes([VERSION, max_ply]) + bytes(HEADER_BYTES - len(MAGIC) - 2))
+        file.write(records.tobytes())
+    os.replace(temp_path, path)
+
+    if verbose:
+        print(f"Wrote {len(records)} positions to {path} in {time.time() - start:.2f} seconds")
+    return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a Connect4 opening book')
+    parser.add_argument('--output', type=str, default='models/opening_book.bin',
+                        help='Path to write the opening book to.')
+    parser.add_argument('--plies', type=int, default=4,
+                        help='Deepest position (in moves played) stored in the book.')
+    parser.add_argument('--depth', type=int, default=10,
+                        help='Search depth used to solve each position.')
+    args = parser.parse_args()
+
+    build_book(args.output, max_ply=args.plies, depth=args.depth)
@@ -0,0 +1,36 @@
+from collections import deque
+import agent
+import numpy_policy
+
+# Opponents for self-play training (main.py --iterative).
+# The pool holds copies of the training policy's Q-network taken in memory (as NumPy arrays, see
+# export_model.network_arrays) along with fixed baseline players such as random or a shallow solver. Each training
+# game draws its opponent from the pool when it is reset, so new snapshots are picked up by the running envs
+# without saving, reloading or rebuilding anything.
+
+
+class OpponentPool:
+
+    def __init__(self, baselines, max_snapshots=5, baseline_rate=0.2, symbol='x', headless=True):
+        self.baselines = list(baselines)                # Fixed players, the only choice until a snapshot is added
+        self.max_snapshots = max_snapshots              # Snapshots kept, the oldest being dropped first
+        self.baseline_rate = baseline_rate              # Chance of drawing a baseline once there are snapshots
+        self.symbol = symbol                            # Symbol the snapshot players play as
+        self.headless = headless
+        self.snapshots = deque(maxlen=max_snapshots)    # Players of the past policies, oldest first
+        self.snapshots_added = 0
+
+    def __len__(self):
+        return len(self.baselines) + len(self.snapshots)
+
+    # Adds a snapshot of the policy from its Q-network arrays. The snapshot plays its greedy legal move.
+    def add_snapshot(self, arrays):
+        network = numpy_policy.NumpyQNetwork(arrays)
+        self.snapshots.append(agent.NumpyQAgent(self.symbol, self.headless, network, deterministic=True))
+        self.snapshots_added += 1
+
+    # Returns the opponent for a new game, drawn with the given NumPy generator.
+    def sample(self, rng):
+        if not self.snapshots or rng.random() < self.baseline_rate:
+            return self.baselines[rng.integers(len(self.baselines))]
+        return self.snapshots[rng.integers(len(self.snapshots))]
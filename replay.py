@@ -0,0 +1,151 @@
+from typing import NamedTuple
+import numpy as np
+import torch as th
+from stable_baselines3.common.buffers import ReplayBuffer
+
+# Replay buffers for the Stable Baselines3 DQN training in main.py.
+
+
+# Replay buffer that also stores the left-right mirror image of every transition.
+# Connect 4 and its rewards are symmetric, so the mirrored board with the mirrored column (6 - action)
+# is just as valid an experience, doubling the samples gathered per simulated step.
+class MirroredReplayBuffer(ReplayBuffer):
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        super().add(obs, next_obs, action, reward, done, infos)
+        super().add(obs[..., ::-1], next_obs[..., ::-1], self.action_space.n - 1 - action, reward, done, infos)
+
+
+# Binary tree over an array whose every node holds the sum of the priorities below it, so priorities can be
+# updated and drawn in proportion to their size in O(log n). Node 1 is the root, the children of node i are 2i and
+# 2i + 1, and the leaves (one per entry, padded to a power of two) start at index leaf_start.
+# Every operation takes a whole batch of entries, walking the levels of the tree with NumPy.
+class SumTree:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.depth = max(0, (capacity - 1).bit_length())
+        self.leaf_start = 1 << self.depth
+        self.nodes = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+    # Returns the sum of every priority.
+    def total(self):
+        return self.nodes[1]
+
+    # Returns the priorities of the entries.
+    def get(self, indices):
+        return self.nodes[self.leaf_start + np.asarray(indices)]
+
+    # Sets the priorities of the entries and recomputes the sums above them.
+    def update(self, indices, priorities):
+        nodes = self.leaf_start + np.atleast_1d(indices)
+        if len(nodes) == 1:
+            self.update_one(int(nodes[0]), float(np.ravel(priorities)[0]))
+            return
+
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            # Parents shared by several entries are recomputed once per entry, with the same result
+            nodes //= 2
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    # Sets the priority of a single leaf node, walking up the tree in Python (much faster than NumPy for one entry,
+    # as added on each step of a single env).
+    def update_one(self, node, priority):
+        tree = self.nodes
+        tree[node] = priority
+        while node > 1:
+            node //= 2
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+
+    # Returns, for each value in [0, total), the entry whose span of the cumulative priorities contains it.
+    def find(self, values):
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.nodes[left]
+            go_right = values >= left_sums
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.leaf_start
+
+
+# Samples of a prioritized replay buffer: the usual fields, each sample's importance-sampling weight and its
+# entry in the buffer (for update_priorities).
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+
+# Prioritized experience replay (Schaul et al., 2016), proportional variant.
+# Transitions are drawn with probability proportional to priority ** alpha, where the priority is the last TD error
+# seen for them (new transitions get the highest priority so far, so each is replayed at least once). Rare
+# transitions with large errors, such as wins and losses, are replayed far more often than the many living-reward
+# ones, and importance-sampling weights (N * P(i)) ** -beta, scaled so the largest in the batch is 1, correct the
+# bias this adds to the updates. beta is raised towards 1 by the algorithm as training goes on.
+class PrioritizedReplayBuffer(ReplayBuffer):
+
+    def __init__(self, buffer_size, observation_space, action_space, device='auto', n_envs=1,
+                 optimize_memory_usage=False, handle_timeout_termination=True, alpha=0.6, beta=0.4, epsilon=1e-6):
+        if optimize_memory_usage:
+            raise ValueError("PrioritizedReplayBuffer doesn't support optimize_memory_usage.")
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs,
+                         handle_timeout_termination=handle_timeout_termination)
+        self.alpha = alpha                  # How strongly priorities skew sampling (0 is uniform)
+        self.beta = beta                    # How much the importance-sampling weights correct for it (1 is fully)
+        self.beta_start = beta              # beta at the start of training
+        self.epsilon = epsilon              # Added to each TD error so no transition stops being drawn
+        self.max_priority = 1.0
+
+        # One entry per stored transition of each env, at index pos * n_envs + env
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+
+    # Number of transitions stored.
+    def num_entries(self):
+        return (self.buffer_size if self.full else self.pos) * self.n_envs
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        entries = self.pos * self.n_envs + np.arange(self.n_envs)
+        super().add(obs, next_obs, action, reward, done, infos)
+        self.tree.update(entries, self.max_priority)
+
+    def sample(self, batch_size, env=None):
+        # One value from each of batch_size equal slices of the total priority
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.rand(batch_size)) * (total / batch_size)
+        num_entries = self.num_entries()
+        indices = np.minimum(self.tree.find(values), num_entries - 1)   # Guarding against rounding past the last entry
+
+        # Importance-sampling weights, relative to the largest in the batch
+        probabilities = self.tree.get(indices) / total
+        weights = (num_entries * probabilities) ** -self.beta
+        weights /= weights.max()
+
+        batch_inds, env_indices = np.divmod(indices, self.n_envs)
+        data = (
+            self._normalize_obs(self.observations[batch_inds, env_indices, :], env),
+            self.actions[batch_inds, env_indices, :],
+            self._normalize_obs(self.next_observations[batch_inds, env_indices, :], env),
+            # Only use dones that are not due to timeouts
+            (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+            weights.astype(np.float32).reshape(-1, 1),
+        )
+        return PrioritizedReplayBufferSamples(*map(self.to_torch, data), indices)
+
+    # Sets the priorities of the sampled entries from their new absolute TD errors.
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities)
+
+
+# Prioritized replay buffer that also stores the mirror image of every transition (see MirroredReplayBuffer).
+class MirroredPrioritizedReplayBuffer(MirroredReplayBuffer, PrioritizedReplayBuffer):
+    pass
@@ -1,8 +1,9 @@
 from flask import Flask, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
 from game import Connect4
-from agent import RandomAgent
+from agent import RandomAgent, DeepQLearningAgentSB
 import eventlet
+import model_registry
 import logging
 import os
 
@@ -14,6 +15,31 @@ socketio = SocketIO(app)
 
 games = {}
 
+# Opening book used by the AI opponents when one has been built
+BOOK_PATH = os.environ.get('OPENING_BOOK', 'models/opening_book.bin')
+book_path = BOOK_PATH if os.path.exists(BOOK_PATH) else None
+
+# Deterministic AI opponents reuse cached moves for positions they have already seen (shared across games)
+DETERMINISTIC = os.environ.get('DETERMINISTIC_AI', '0') == '1'
+CACHE_SIZE = int(os.environ.get('INFERENCE_CACHE_SIZE', 100_000))
+
+# Models are loaded once and shared by every game, keeping at most this many in memory
+model_registry.registry.max_models = int(os.environ.get('MAX_LOADED_MODELS', 4))
+
+# Model moves from all sessions are batched together, waiting at most this long or for this many requests
+BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_WINDOW_MS', 3.0))
+MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 32))
+
+# Routes the game's model players through the shared batching dispatcher for their model.
+# The dispatcher needs torch, so it is only imported once a game with a model player is started.
+def attach_dispatchers(game):
+    for player in (game.player1, game.player2):
+        if isinstance(player, DeepQLearningAgentSB) and player.model_path is not None:
+            import inference
+            model = player.agent
+            key = model_registry.registry.key(player.model_path)
+            player.dispatcher = inference.get_dispatcher(key, model, BATCH_WINDOW_MS, MAX_BATCH)
+
 @app.route('/health')
 def health_check():
     return jsonify({"status": "healthy"}), 200
@@ -111,7 +137,11 @@ def handle_new_game(data):
                     player2=player2, 
                     player1_symbol='o', 
                     player2_symbol='x', 
-                    headless=True)
+                    headless=True,
+                    book_path=book_path,
+                    deterministic=DETERMINISTIC,
+                    cache_size=CACHE_SIZE)
+    attach_dispatchers(game)
 
     # Set human_color only if human vs AI
     if opponent != 'human':
@@ -0,0 +1,91 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# Short end-to-end runs that fail (exit status 1) when any of them breaks.
+#   python smoke_test.py train
+#   python smoke_test.py beta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Player pairings trained for a few games with the NumPy DQN ('dql'), each paired with a player that doesn't learn
+TRAIN_MATCHUPS = [('dql', 'random'), ('dql', os.path.join(REPO_DIR, 'models', 'spaced14.zip')),
+                  (os.path.join(REPO_DIR, 'models', 'spaced14.zip'), 'dql')]
+
+
+# Runs main.py --mode train for each pairing in a temporary directory, checking it exits cleanly and keeps the NumPy
+# DQN's latest keep_checkpoints checkpoints plus the best scoring one (from the scores logged to output.txt).
+# Returns True if all of them do.
+def smoke_train(matchups=TRAIN_MATCHUPS, episodes=20, save_rate=5, keep_checkpoints=1):
+    passed = True
+    for player1, player2 in matchups:
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run([sys.executable, '-W', 'ignore', os.path.join(REPO_DIR, 'main.py'), '--mode', 'train',
+                                     '--player1', player1, '--player2', player2, '--episodes', str(episodes),
+                                     '--save_rate', str(save_rate), '--keep_checkpoints', str(keep_checkpoints),
+                                     '--eval_games', '20', '--headless'],
+                                    cwd=directory, capture_output=True, text=True)
+            saved, expected = set(), None
+            if result.returncode == 0:
+                saved = set(os.listdir(os.path.join(directory, 'models')))
+                with open(os.path.join(directory, 'output.txt')) as file:
+                    scores = [(line.split()[1], float(line.split()[-1])) for line in file if line.startswith('Saved ')]
+                best = max(scores, key=lambda checkpoint: checkpoint[1])[0]
+                expected = {name for name, _ in scores[-keep_checkpoints:]} | {best}
+            ok = result.returncode == 0 and saved == expected
+        passed = passed and ok
+        error = f"\n{result.stderr.strip()}" if result.returncode != 0 else ''
+        print(f"{'PASS' if ok else 'FAIL'}\ttrain {os.path.basename(player1)} vs {os.path.basename(player2)}: "
+              f"kept {', '.join(sorted(saved)) or 'nothing'}{error}")
+    return passed
+
+
+# Trains a MaskedDQN with prioritized replay over two learn calls (each resetting num_timesteps, as main.py's training
+# rounds do) and checks that beta rises steadily across both towards 1 instead of starting over. Returns True if it does.
+def smoke_beta(timesteps=200, learn_calls=2):
+    import warnings
+    warnings.filterwarnings('ignore')
+    from game import Connect4
+    from masked_dqn import MaskedDQN
+    from replay import PrioritizedReplayBuffer
+
+    env = Connect4(mode='train', player1='dqlsb', player2='random', headless=True)
+    model = MaskedDQN('MlpPolicy', env, buffer_size=1000, learning_starts=50, batch_size=16,
+                      replay_buffer_class=PrioritizedReplayBuffer, beta_timesteps=timesteps * learn_calls, seed=0)
+
+    # Recording beta after every training step
+    betas, train = [], model.train
+    def train_and_record(gradient_steps, batch_size=100):
+        train(gradient_steps, batch_size)
+        betas.append(model.replay_buffer.beta)
+    model.train = train_and_record
+
+    rounds = []
+    for _ in range(learn_calls):
+        model.learn(total_timesteps=timesteps)
+        rounds.append(len(betas))
+
+    ok = all(b >= a for a, b in zip(betas, betas[1:])) and 0.9 < betas[-1] <= 1.0
+    print(f"{'PASS' if ok else 'FAIL'}\tbeta over {learn_calls} learn calls: "
+          f"{', '.join(f'{betas[i - 1]:.2f}' for i in rounds)} at the end of each "
+          f"(from {betas[0]:.2f}, {'rising steadily' if ok else 'not rising steadily to 1'})")
+    return ok
+
+
+CHECKS = {'train': smoke_train, 'beta': smoke_beta}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Connect4 smoke tests')
+    parser.add_argument('checks', nargs='*', help=f"Checks to run, from {', '.join(CHECKS)} (default: all of them).")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown check(s): {', '.join(unknown)}")
+
+    results = [CHECKS[name]() for name in args.checks or CHECKS]
+    if not all(results):
+        sys.exit(1)
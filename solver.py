@@ -0,0 +1,309 @@
+import time
+from array import array
+import numpy as np
+import bitboard
+
+# Scores are from the point of view of the player to move. A win is worth WIN_SCORE minus the number of
+# moves played when it happens, so faster wins (and slower losses) score better than any heuristic value.
+WIN_SCORE = 1000
+THREAT_WEIGHT = 4
+
+# Columns searched from the center outwards, since central moves take part in the most lines
+MOVE_ORDER = [3, 2, 4, 1, 5, 0, 6]
+
+# The same order with a given column (e.g. the transposition table's best move) searched first
+MOVE_ORDER_FROM = [[first] + [col for col in MOVE_ORDER if col != first] for first in range(bitboard.WIDTH)]
+
+# Kinds of score stored in the transposition table
+EMPTY, EXACT, LOWER, UPPER = 0, 1, 2, 3
+
+# Bit that lands when a piece is dropped into each column
+BOTTOM_BITS = [bitboard.cell_bit(col, 0) for col in range(bitboard.WIDTH)]
+CENTER_MASK = bitboard.COLUMN_MASKS[3]
+
+
+# Raised inside the search when the time budget runs out.
+class SearchTimeout(Exception):
+    pass
+
+
+# A Connect 4 position for searching, stored as the mask of the player to move and the mask of all pieces.
+# Moves are made and unmade in place so a search never allocates new positions.
+class Position:
+
+    def __init__(self, current=0, mask=0):
+        self.current = current
+        self.mask = mask
+        self.moves = bitboard.popcount(mask)
+
+        # Zobrist hash, with colour 0 for the player who moved first, and the hash of the mirror image
+        opponent = current ^ mask
+        first, second = (current, opponent) if self.moves % 2 == 0 else (opponent, current)
+        self.hash = bitboard.zobrist_hash(first, second)
+        self.mirror_hash = bitboard.zobrist_hash(bitboard.mirror(first), bitboard.mirror(second))
+
+    # Builds a position from an observation of the player to move (1 own, -1 opponent).
+    @classmethod
+    def from_state(cls, state):
+        state = np.asarray(state)
+        return cls(bitboard.from_array(state == 1), bitboard.from_array(state))
+
+    # Returns the key shared with the mirror image, and whether it is the mirror image's hash.
+    def canonical(self):
+        if self.mirror_hash < self.hash:
+            return self.mirror_hash, True
+        return self.hash, False
+
+    # Returns the mask of the cells that can be played next.
+    def possible(self):
+        return (self.mask + bitboard.BOTTOM_MASK) & bitboard.BOARD_MASK
+
+    # Returns True if the column still has room.
+    def can_play(self, col):
+        return bool(self.possible() & bitboard.COLUMN_MASKS[col])
+
+    # Plays the column for the player to move, who then becomes the opponent.
+    def play(self, col):
+        mask = self.mask | (self.mask + BOTTOM_BITS[col])
+        index = (mask ^ self.mask).bit_length() - 1
+        self.hash ^= bitboard.ZOBRIST_KEYS[self.moves & 1][index]
+        self.mirror_hash ^= bitboard.ZOBRIST_KEYS[self.moves & 1][bitboard.MIRROR_INDEX[index]]
+        self.current ^= self.mask
+        self.mask = mask
+        self.moves += 1
+
+    # Takes back the last piece played in the column.
+    def undo(self, col):
+        index = (self.mask & bitboard.COLUMN_MASKS[col]).bit_length() - 1
+        self.mask ^= 1 << index
+        self.current ^= self.mask
+        self.moves -= 1
+        self.hash ^= bitboard.ZOBRIST_KEYS[self.moves & 1][index]
+        self.mirror_hash ^= bitboard.ZOBRIST_KEYS[self.moves & 1][bitboard.MIRROR_INDEX[index]]
+
+    # Returns True if playing the column wins for the player to move.
+    def is_winning_move(self, col):
+        return bool(bitboard.winning_cells(self.current, self.mask) & self.possible() & bitboard.COLUMN_MASKS[col])
+
+
+# Fixed-size transposition table of search results keyed by Zobrist hash.
+# Entries live in parallel typed arrays (13 bytes each) indexed by the low bits of the hash. When two positions
+# share a slot, the one searched deeper is kept.
+class TranspositionTable:
+
+    ENTRY_BYTES = 8 + 2 + 1 + 1 + 1     # Key, score, depth, kind of score, best move
+
+    def __init__(self, size_mb=16):
+        # Largest power-of-two number of entries that fits in the memory cap
+        entries = max(1, int(size_mb * 2**20) // self.ENTRY_BYTES)
+        self.size = 1 << (entries.bit_length() - 1)
+        self.index_mask = self.size - 1
+
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('h', bytes(2 * self.size))
+        self.depths = array('b', bytes(self.size))
+        self.flags = array('b', bytes(self.size))
+        self.moves = array('b', bytes(self.size))
+        self.reset_stats()
+
+    # Returns the memory used by the table in MB.
+    def size_mb(self):
+        return self.size * self.ENTRY_BYTES / 2**20
+
+    # Clears the hit/miss/collision counters.
+    def reset_stats(self):
+        self.hits = 0           # Probes that found the position
+        self.misses = 0         # Probes that found an empty slot or another position
+        self.collisions = 0     # Probes that found another position in the slot
+        self.stores = 0         # Entries written
+        self.overwrites = 0     # Entries written over a different position
+        self.rejected = 0       # Stores dropped because the slot held a deeper search
+
+    # Returns the counters as a dictionary.
+    def stats(self):
+        probes = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'collisions': self.collisions, 'stores': self.stores,
+                'overwrites': self.overwrites, 'rejected': self.rejected,
+                'hit_rate': self.hits / probes if probes else 0.0}
+
+    # Empties the table.
+    def clear(self):
+        for i in range(self.size):
+            self.flags[i] = EMPTY
+
+    # Returns (depth, kind, score, best move) stored for the position, or None.
+    def probe(self, key):
+        i = key & self.index_mask
+        if self.flags[i] != EMPTY:
+            if self.keys[i] == key:
+                self.hits += 1
+                return self.depths[i], self.flags[i], self.scores[i], self.moves[i]
+            self.collisions += 1
+        self.misses += 1
+        return None
+
+    # Stores a search result, keeping whichever of the old and new entries was searched deeper.
+    def store(self, key, depth, flag, score, move):
+        i = key & self.index_mask
+        if self.flags[i] != EMPTY and self.keys[i] != key:
+            if depth < self.depths[i]:
+                self.rejected += 1
+                return
+            self.overwrites += 1
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.scores[i] = score
+        self.moves[i] = move
+        self.stores += 1
+
+
+# Negamax search with alpha-beta pruning over bitboard positions.
+class Solver:
+
+    def __init__(self, max_depth=8, time_limit=None, table_mb=16):
+        self.max_depth = max_depth          # Deepest search in plies
+        self.time_limit = time_limit        # Seconds per move, searched by iterative deepening (None for no limit)
+        self.table = TranspositionTable(table_mb) if table_mb else None
+        self.nodes = 0
+        self.elapsed = 0.0
+        self.depth_reached = 0
+        self.deadline = None
+
+    # Returns the number of nodes searched per second during the last search.
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    # Returns the best column and its score for the player to move.
+    def search(self, position):
+        self.nodes = 0
+        self.depth_reached = 0
+        start = time.perf_counter()
+        self.deadline = start + self.time_limit if self.time_limit is not None else None
+
+        # Any legal move will do if the search is cut off before depth 1 finishes
+        moves = [col for col in MOVE_ORDER if position.can_play(col)]
+        best_col, best_score = moves[0], 0
+
+        # Iterative deepening, trying the previous depth's best move first
+        try:
+            for depth in range(1, self.max_depth + 1):
+                best_col, best_score = self.search_root(position, depth, best_col)
+                self.depth_reached = depth
+                if abs(best_score) >= WIN_SCORE - 42 or position.moves + depth >= 42:
+                    break
+        except SearchTimeout:
+            pass
+
+        self.elapsed = time.perf_counter() - start
+        return best_col, best_score
+
+    # Searches every move at the root and returns the best one with its score.
+    def search_root(self, position, depth, first):
+        self.nodes += 1
+        moves = [first] + [col for col in MOVE_ORDER if col != first and position.can_play(col)]
+        best_col, alpha, beta = moves[0], -WIN_SCORE, WIN_SCORE
+        for col in moves:
+            if position.is_winning_move(col):
+                return col, WIN_SCORE - position.moves - 1
+            position.play(col)
+            score = -self.negamax(position, depth - 1, -beta, -alpha)
+            position.undo(col)
+            if score > alpha:
+                best_col, alpha = col, score
+        return best_col, alpha
+
+    # Returns the score of the position for the player to move, searching depth plies ahead.
+    def negamax(self, position, depth, alpha, beta):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        # Draw when the board is full
+        if position.moves == 42:
+            return 0
+
+        # Winning straight away
+        possible = position.possible()
+        own_wins = bitboard.winning_cells(position.current, position.mask)
+        if own_wins & possible:
+            return WIN_SCORE - position.moves - 1
+
+        # Blocking the opponent's immediate wins, losing if there are two of them
+        opponent = position.current ^ position.mask
+        opponent_wins = bitboard.winning_cells(opponent, position.mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return -(WIN_SCORE - position.moves - 2)
+            possible = forced
+
+        # Never playing directly below a cell the opponent wins with
+        possible &= ~(opponent_wins >> 1)
+        if not possible:
+            return -(WIN_SCORE - position.moves - 2)
+
+        # Heuristic value at the search horizon
+        if depth <= 0:
+            return self.evaluate(position, own_wins, opponent_wins)
+
+        # The player to move cannot win before their next-but-one move
+        max_score = WIN_SCORE - position.moves - 3
+        if beta > max_score:
+            beta = max_score
+            if alpha >= beta:
+                return beta
+
+        # Using a stored result of an equally deep search, or at least its best move
+        # The table is keyed by the canonical hash, so a position and its mirror image share an entry
+        # (with the best move stored as seen in the canonical form)
+        order = MOVE_ORDER
+        original_alpha = alpha
+        if self.table is not None:
+            key, mirrored = position.canonical()
+            entry = self.table.probe(key)
+            if entry is not None:
+                entry_depth, flag, score, move = entry
+                if entry_depth >= depth:
+                    if flag == EXACT:
+                        return score
+                    elif flag == LOWER and score > alpha:
+                        alpha = score
+                    elif flag == UPPER and score < beta:
+                        beta = score
+                    if alpha >= beta:
+                        return score
+                if move >= 0:
+                    order = MOVE_ORDER_FROM[bitboard.WIDTH - 1 - move if mirrored else move]
+
+        best_score, best_col = -WIN_SCORE, -1
+        for col in order:
+            if possible & bitboard.COLUMN_MASKS[col]:
+                position.play(col)
+                score = -self.negamax(position, depth - 1, -beta, -alpha)
+                position.undo(col)
+                if score > best_score:
+                    best_score, best_col = score, col
+                    if score > alpha:
+                        alpha = score
+                        if alpha >= beta:
+                            break
+
+        if self.table is not None:
+            if best_score <= original_alpha:
+                flag = UPPER
+            elif best_score >= beta:
+                flag = LOWER
+            else:
+                flag = EXACT
+            if mirrored and best_col >= 0:
+                best_col = bitboard.WIDTH - 1 - best_col
+            self.table.store(key, depth, flag, best_score, best_col)
+        return best_score
+
+    # Scores a quiet position by the difference in open winning cells and center pieces.
+    def evaluate(self, position, own_wins, opponent_wins):
+        opponent = position.current ^ position.mask
+        threats = bitboard.popcount(own_wins) - bitboard.popcount(opponent_wins)
+        center = bitboard.popcount(position.current & CENTER_MASK) - bitboard.popcount(opponent & CENTER_MASK)
+        return THREAT_WEIGHT * threats + center
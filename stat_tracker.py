@@ -0,0 +1,166 @@
+from stable_baselines3.common.callbacks import BaseCallback
+
+class StatTracker(BaseCallback):
+    def __init__(self, verbose=0):
+        super().__init__(verbose)
+        # Tracking total win/losses/ties
+        self.num_agent_wins = 0
+        self.num_opponent_wins = 0
+        self.num_ties = 0
+
+        # Tracking direction of win
+        self.num_agent_v_wins = 0
+        self.num_agent_h_wins = 0
+        self.num_agent_du_wins = 0
+        self.num_agent_dd_wins = 0
+
+        # Tracking opponent's direction for wins
+        self.num_opponent_v_wins = 0
+        self.num_opponent_h_wins = 0
+        self.num_opponent_du_wins = 0
+        self.num_opponent_dd_wins = 0
+
+        # Wins as p1 vs p2
+        self.num_agent_p1_wins = 0
+        self.num_agent_p2_wins = 0
+        self.num_opponent_p1_wins = 0
+        self.num_opponent_p2_wins = 0
+
+    def _on_step(self) -> bool:
+        # Accessing step information
+        dones = self.locals['dones']
+        infos = self.locals['infos']
+
+        # info = {'agent_player_num': player_num, 'agent_win': agent_win, 'tie': tie, 'win_dir': four_dir,
+        #         'win_result': WinResult (single game env only)}
+
+        for i, done in enumerate(dones):
+            if done:
+                info = infos[i]
+
+                # Direction from the win result recorded when the win was found, if the env provides one
+                win_result = info.get('win_result')
+                win_dir = win_result.direction if win_result is not None else info['win_dir']
+
+                # Check for agent win
+                if info['agent_win']:
+                    self.num_agent_wins += 1
+
+                    # Check for player 1 vs 2 win
+                    if info['agent_player_num'] == '1':
+                        self.num_agent_p1_wins += 1
+                    else:
+                        self.num_agent_p2_wins += 1
+
+                    # Check for vertical win
+                    if win_dir == 'v':
+                        self.num_agent_v_wins += 1
+
+                    # Check for horizontal win
+                    elif win_dir == 'h':
+                        self.num_agent_h_wins += 1
+
+                    # Check for upward diagonal
+                    elif win_dir == 'du':
+                        self.num_agent_du_wins += 1
+
+                    # Check for downward diagonal
+                    elif win_dir == 'dd':
+                        self.num_agent_dd_wins += 1
+
+                # Otherwise, if a tie
+                elif info['tie']:
+                    self.num_ties += 1
+
+                # Otherwise, opponent win
+                else:
+                    self.num_opponent_wins += 1
+
+                    # Check for player 1 vs 2 win
+                    if info['agent_player_num'] == '1':
+                        self.num_opponent_p2_wins += 1
+                    else:
+                        self.num_opponent_p1_wins += 1
+
+                    # Check for vertical win
+                    if win_dir == 'v':
+                        self.num_opponent_v_wins += 1
+
+                    # Check for horizontal win
+                    elif win_dir == 'h':
+                        self.num_opponent_h_wins += 1
+
+                    # Check for upward diagonal
+                    elif win_dir == 'du':
+                        self.num_opponent_du_wins += 1
+
+                    # Check for downward diagonal
+                    elif win_dir == 'dd':
+                        self.num_opponent_dd_wins += 1
+
+        return True
+    
+    def reset_stats(self):
+        # Tracking total win/losses/ties
+        self.num_agent_wins = 0
+        self.num_opponent_wins = 0
+        self.num_ties = 0
+
+        # Tracking direction of win
+        self.num_agent_v_wins = 0
+        self.num_agent_h_wins = 0
+        self.num_agent_du_wins = 0
+        self.num_agent_dd_wins = 0
+
+        # Tracking opponent's direction for wins
+        self.num_opponent_v_wins = 0
+        self.num_opponent_h_wins = 0
+        self.num_opponent_du_wins = 0
+        self.num_opponent_dd_wins = 0
+
+        # Wins as p1 vs p2
+        self.num_agent_p1_wins = 0
+        self.num_agent_p2_wins = 0
+        self.num_opponent_p1_wins = 0
+        self.num_opponent_p2_wins = 0
+
+    def output_info(self):
+        width = 40
+        final_str = "-"*width + '\n'
+
+        final_str +=    f'\tAgent Wins: \t | {self.num_agent_wins}' + '\n'
+        final_str +=    f'\tOpp Wins: \t\t | {self.num_opponent_wins}' + '\n'
+        final_str +=    f'\tTotal Ties: \t | {self.num_ties}' + '\n'
+        
+        final_str += '\n'
+
+        final_str +=    f'\tA-V Wins: \t | {self.num_agent_v_wins}' + '\n'
+        final_str +=    f'\tA-H Wins: \t | {self.num_agent_h_wins}' + '\n'
+        final_str +=    f'\tA-DU Wins: \t | {self.num_agent_du_wins}' + '\n'
+        final_str +=    f'\tA-DD Wins: \t | {self.num_agent_dd_wins}' + '\n'
+
+        final_str += '\n'
+
+        final_str +=    f'\tO-V Wins: \t | {self.num_opponent_v_wins}' + '\n'
+        final_str +=    f'\tO-H Wins: \t | {self.num_opponent_h_wins}' + '\n'
+        final_str +=    f'\tO-DU Wins: \t | {self.num_opponent_du_wins}' + '\n'
+        final_str +=    f'\tO-DD Wins: \t | {self.num_opponent_dd_wins}' + '\n'
+        
+        final_str += '\n'
+
+        final_str +=    f'\tA P1 Wins: \t | {self.num_agent_p1_wins}' + '\n'
+        final_str +=    f'\tA P2 Wins: \t | {self.num_agent_p2_wins}' + '\n'
+
+        final_str += '\n'
+
+        final_str +=    f'\tO P1 Wins: \t | {self.num_opponent_p1_wins}' + '\n'
+        final_str +=    f'\tO P2 Wins: \t | {self.num_opponent_p2_wins}' + '\n'
+
+        final_str += "-"*width
+
+        print(final_str)
+
+        return final_str
+
+    # def _on_rollout_end(self):
+    #     self.output_info()
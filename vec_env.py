@@ -0,0 +1,225 @@
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+import agent
+import bitboard
+import deepq
+
+# Contains N Connect 4 training games stepped together in NumPy.
+# Follows the same rules as the deepq training step of Connect4: the agent swaps randomly between
+# player 1 and player 2 on each reset, and the opponent's move is made inside the agent's step.
+# With an opponent pool, each game draws its own opponent from the pool when it is reset.
+class Connect4VecEnv(VecEnv):
+
+    render_mode = None
+
+    def __init__(self, num_envs, opponent='random', seed=None, opponent_pool=None, rich_shaping=False):
+        observation_space = spaces.Box(low=-1, high=1, shape=(6, 7), dtype=np.int8)
+        super().__init__(num_envs, observation_space, spaces.Discrete(7))
+
+        # Opponent is either 'random' (played vectorized) or a Player that is asked for each game's move
+        random_opponent = isinstance(opponent, agent.RandomAgent) or opponent == 'random'
+        self.opponent = None if random_opponent else opponent
+        self.opponent_pool = opponent_pool
+        self.rich_shaping = rich_shaping        # Whether rewards include the richer shaping terms (see deepq.py)
+        self.rng = np.random.default_rng(seed)
+        self.actions = None
+
+        # Stacked game state. Cells use the flat observation layout (index (5 - row) * 7 + col),
+        # with the agent's pieces as 1 and the opponent's as -1.
+        self.cells = np.zeros((num_envs, 42), dtype=np.int8)
+        self.heights = np.zeros((num_envs, 7), dtype=np.int8)
+        self.num_moves = np.zeros(num_envs, dtype=np.int8)
+        self.agent_is_p1 = np.zeros(num_envs, dtype=bool)
+        self.dones = np.zeros(num_envs, dtype=bool)
+        self.winners = np.zeros(num_envs, dtype=np.int8)         # 1 agent, -1 opponent, 0 none
+        self.win_dirs = np.full(num_envs, None, dtype=object)
+        self.opponents = np.full(num_envs, None, dtype=object)  # Each game's opponent when drawn from the pool
+
+    # Returns the observations of every game as a (N, 6, 7) array.
+    def get_state(self):
+        return self.cells.reshape(self.num_envs, 6, 7).copy()
+
+    # Resets all of the games.
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.rng = np.random.default_rng(self._seeds[0])
+        self._reset_seeds()
+        self._reset_options()
+
+        self.reset_games(np.arange(self.num_envs))
+        return self.get_state()
+
+    # Resets the games at the given indices.
+    def reset_games(self, idx):
+        self.cells[idx] = 0
+        self.heights[idx] = 0
+        self.num_moves[idx] = 0
+        self.dones[idx] = False
+        self.winners[idx] = 0
+        self.win_dirs[idx] = None
+
+        # Stochastically choosing if agent is p1 or p2 for each game
+        self.agent_is_p1[idx] = self.rng.random(len(idx)) < 0.5
+
+        # Drawing each game's opponent from the pool
+        if self.opponent_pool is not None:
+            for i in idx:
+                self.opponents[i] = self.opponent_pool.sample(self.rng)
+
+    # Adds a snapshot of the training policy's Q-network arrays to the opponent pool.
+    def add_opponent_snapshot(self, arrays):
+        self.opponent_pool.add_snapshot(arrays)
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.int64)
+
+    def step_wait(self):
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+
+        # Opponent moves first in the games where the agent is player 2
+        first = np.flatnonzero(~self.agent_is_p1)
+        rewards[first] += self.opponent_step(first)
+
+        # Agent moves in every game that did not just end
+        idx = np.flatnonzero(~self.dones)
+        rewards[idx] += self.agent_step(idx, self.actions[idx])
+
+        # Opponent replies in the games where the agent is player 1
+        second = np.flatnonzero(self.agent_is_p1 & ~self.dones)
+        rewards[second] += self.opponent_step(second)
+
+        # Building the infos read by the StatTracker (the legal columns are added once finished games are reset)
+        obs = self.get_state()
+        dones = self.dones.copy()
+        infos = []
+        for i in range(self.num_envs):
+            infos.append({
+                'agent_player_num': '1' if self.agent_is_p1[i] else '2',
+                'agent_win': bool(self.winners[i] == 1),
+                'tie': bool(self.winners[i] == 0),
+                'win_dir': self.win_dirs[i],
+            })
+
+        # Automatically resetting the finished games
+        ended = np.flatnonzero(dones)
+        if len(ended):
+            for i in ended:
+                infos[i]['terminal_observation'] = obs[i].copy()
+            self.reset_games(ended)
+            obs[ended] = 0
+
+        # Legal columns for the agent's next move in each game
+        legal = self.heights < 6
+        for i in range(self.num_envs):
+            infos[i]['action_mask'] = legal[i]
+
+        return obs, rewards, dones, infos
+
+    # Places a piece for the given side (1 agent, -1 opponent) in each game's column and returns the flat cells used.
+    def place(self, idx, cols, side):
+        rows = self.heights[idx, cols].astype(np.int64)
+        flat = (5 - rows) * 7 + cols
+        self.cells[idx, flat] = side
+        self.heights[idx, cols] += 1
+        self.num_moves[idx] += 1
+        return flat
+
+    # Returns, for each game, the index of a window fully owned by the given side (or -1).
+    def find_wins(self, cells, side):
+        complete = (cells[:, bitboard.WINDOW_INDICES].sum(axis=-1) == 4 * side)
+        return np.where(complete.any(axis=-1), complete.argmax(axis=-1), -1)
+
+    # Marks the games where the side just won or filled the board as done.
+    def record_results(self, idx, side):
+        windows = self.find_wins(self.cells[idx], side)
+        won = windows >= 0
+        self.winners[idx[won]] = side
+        self.win_dirs[idx[won]] = [bitboard.WINDOW_DIRECTIONS[w] for w in windows[won]]
+        full = self.num_moves[idx] == 42
+        self.dones[idx[won | full]] = True
+        return won, full
+
+    # Plays the agent's actions in the given games and returns the agent's rewards.
+    def agent_step(self, idx, actions):
+        rewards = np.full(len(idx), deepq.INVALID_RW, dtype=np.float32)
+
+        # Invalid moves are penalized and leave the board unchanged
+        valid = self.heights[idx, actions] < 6
+        idx, actions = idx[valid], actions[valid]
+        flat = self.place(idx, actions, 1)
+
+        # Shaping rewards for every game's move at once
+        move_rewards = deepq.shaped_reward(deepq.batch_move_features(self.cells[idx], flat), self.rich_shaping)
+
+        # Checking for an agent win, then for a draw
+        won, full = self.record_results(idx, 1)
+        move_rewards = move_rewards + deepq.WIN_RW * won
+        move_rewards[full] = 0
+
+        rewards[valid] = move_rewards
+        return rewards
+
+    # Plays the opponent's moves in the given games and returns the agent's rewards.
+    def opponent_step(self, idx):
+        if len(idx) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        # Choosing the opponent's columns, together for the games sharing an opponent
+        legal = self.heights[idx] < 6
+        if self.opponent_pool is None:
+            cols = self.opponent_moves(self.opponent, idx, legal)
+        else:
+            cols = np.empty(len(idx), dtype=np.int64)
+            opponents = self.opponents[idx]
+            for opponent in dict.fromkeys(opponents):
+                group = np.flatnonzero(opponents == opponent)
+                cols[group] = self.opponent_moves(opponent, idx[group], legal[group])
+        self.place(idx, cols, -1)
+
+        # Checking for an opponent win, then for a draw
+        won, full = self.record_results(idx, -1)
+        rewards = np.where(won, deepq.LOSS_RW, 0.0).astype(np.float32)
+        rewards[full] = 0
+        return rewards
+
+    # Returns the opponent's column in each of the given games, given their legal columns.
+    def opponent_moves(self, opponent, idx, legal):
+        if opponent is None or isinstance(opponent, agent.RandomAgent):
+            # Uniformly random legal column for every game at once
+            return (self.rng.random(legal.shape) * legal).argmax(axis=1)
+
+        states = -self.cells[idx].reshape(-1, 6, 7)
+        if isinstance(opponent, agent.NumpyQAgent) and opponent.deterministic and opponent.book is None:
+            # Greedy legal column from one forward pass over every game
+            return opponent.network.predict(states)
+
+        cols = np.empty(len(idx), dtype=np.int64)
+        for j in range(len(idx)):
+            cols[j] = opponent.next_move(np.flatnonzero(legal[j]).tolist(), states[j])
+        return cols
+
+    def close(self):
+        pass
+
+    # Returns the given indices as a list.
+    def get_indices(self, indices):
+        if indices is None:
+            return list(range(self.num_envs))
+        if isinstance(indices, int):
+            return [indices]
+        return list(indices)
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self.get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    # The games share this object, so the method is called once and its result given for each index
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self.get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self.get_indices(indices)]